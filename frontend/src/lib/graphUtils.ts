@@ -41,24 +41,114 @@ export function createUniformSizeArray(numPoints: number, size: number): Float32
 }
 
 /**
-* Applies a color to specific point indices in an existing color array
+* Unpacks binary coordinates from /api/visualise/get-coordinates-binary
+* @param buffer - Little-endian uint32 count, int32 ids, then float32 x/y pairs
+* @returns Point ids and interleaved positions ready for setPointPositions
+*/
+export function unpackCoordinates(buffer: ArrayBuffer): { ids: Int32Array; positions: Float32Array } {
+    const count = new DataView(buffer).getUint32(0, true);
+    const ids = new Int32Array(buffer, 4, count);
+    const positions = new Float32Array(buffer, 4 + count * 4, count * 2);
+    return { ids, positions };
+}
+
+/**
+* Creates a lookup from point id to point index
+* @param ids - Point ids in point index order
+* @returns Map of id to index
+*/
+export function createIdToIndexMap(ids: Int32Array): Map<number, number> {
+    const idToIndex = new Map<number, number>();
+    for (let i = 0; i < ids.length; i++) {
+        idToIndex.set(ids[i], i);
+    }
+    return idToIndex;
+}
+
+/**
+* Converts point ids to point indices, skipping ids that are not plotted
+* @param ids - Point ids, e.g. from a highlight query
+* @param idToIndex - Lookup from createIdToIndexMap
+* @returns Point indices
+*/
+export function idsToIndexes(ids: number[], idToIndex: Map<number, number>): number[] {
+    const indexes: number[] = [];
+    for (const id of ids) {
+        const index = idToIndex.get(id);
+        if (index !== undefined) {
+            indexes.push(index);
+        }
+    }
+    return indexes;
+}
+/**
+* Unpacks bucket numbers from a binary sequential or categorical query
+* @param buffer - Little-endian uint16 bucket count, then one bucket number per id
+* @returns Bucket count and bucket numbers indexed by id, where 0 means no bucket
+*/
+export function unpackBucketNumbers(buffer: ArrayBuffer): { count: number; numbers: Uint8Array | Uint16Array } {
+    const count = new DataView(buffer).getUint16(0, true);
+    const numbers = count < 256
+        ? new Uint8Array(buffer, 2)
+        : new Uint16Array(buffer, 2, (buffer.byteLength - 2) / 2);
+    return { count, numbers };
+}
+
+/**
+* Applies a color to points whose id is set in a bitmap, without building id arrays
 * @param existingColors - Current color array (will be cloned)
-* @param indices - Point indices to color
+* @param bitmap - Little-endian bitmap from a binary simple query, bit n set for id n
+* @param ids - Point ids in point index order
 * @param color - RGBA color as Float32Array [r, g, b, a]
 * @returns New Float32Array with updated colors
 */
-export function applyColorToIndices(
+export function applyColorToBitmap(
     existingColors: Float32Array,
-    indices: number[],
+    bitmap: Uint8Array,
+    ids: Int32Array,
     color: Float32Array
 ): Float32Array {
     const newColors = existingColors.slice();
-    for (const idx of indices) {
-        const offset = idx * 4;
-        newColors[offset] = color[0];
-        newColors[offset + 1] = color[1];
-        newColors[offset + 2] = color[2];
-        newColors[offset + 3] = color[3];
+    for (let i = 0; i < ids.length; i++) {
+        const id = ids[i];
+        const byte = id >> 3;
+        if (byte < bitmap.length && (bitmap[byte] >> (id & 7)) & 1) {
+            const offset = i * 4;
+            newColors[offset] = color[0];
+            newColors[offset + 1] = color[1];
+            newColors[offset + 2] = color[2];
+            newColors[offset + 3] = color[3];
+        }
+    }
+    return newColors;
+}
+
+/**
+* Applies one color per bucket to points by the bucket number of their id
+* @param existingColors - Current color array (will be cloned)
+* @param numbers - Bucket numbers indexed by id from unpackBucketNumbers
+* @param ids - Point ids in point index order
+* @param colors - RGBA colors, one per bucket
+* @returns New Float32Array with updated colors
+*/
+export function applyColorsToBucketNumbers(
+    existingColors: Float32Array,
+    numbers: Uint8Array | Uint16Array,
+    ids: Int32Array,
+    colors: Float32Array[]
+): Float32Array {
+    const newColors = existingColors.slice();
+    for (let i = 0; i < ids.length; i++) {
+        const id = ids[i];
+        const number = id < numbers.length ? numbers[id] : 0;
+        if (number > 0 && number <= colors.length) {
+            const color = colors[number - 1];
+            const offset = i * 4;
+            newColors[offset] = color[0];
+            newColors[offset + 1] = color[1];
+            newColors[offset + 2] = color[2];
+            newColors[offset + 3] = color[3];
+        }
     }
     return newColors;
 }
\ No newline at end of file
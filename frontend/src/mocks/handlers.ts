@@ -26,8 +26,38 @@ let mockDatabases = [
     { name: "db2.db", tables: { data: { columns: mockColumns, row_count: 30 } } }
 ];
 
+function packIdBitmap(ids: number[]) {
+    const bitmap = new Uint8Array((Math.max(...ids) >> 3) + 1);
+    for (const id of ids) {
+        bitmap[id >> 3] |= 1 << (id & 7);
+    }
+    return HttpResponse.arrayBuffer(bitmap.buffer, { headers: { 'Content-Type': 'application/octet-stream' } });
+}
+
+function packBucketNumbers(buckets: number[][]) {
+    const size = Math.max(...buckets.flat()) + 1;
+    const buffer = new ArrayBuffer(2 + size);
+    new DataView(buffer).setUint16(0, buckets.length, true);
+    const numbers = new Uint8Array(buffer, 2);
+    buckets.forEach((bucket, i) => bucket.forEach((id) => (numbers[id] = i + 1)));
+    return HttpResponse.arrayBuffer(buffer, { headers: { 'Content-Type': 'application/octet-stream' } });
+}
+
 export const handlers = [
     http.get('/api/visualise/get-coordinates', () => HttpResponse.json(mockCoordinates)),
+    http.get('/api/visualise/get-coordinates-binary', () => {
+        const count = mockCoordinates.coordinates.x.length;
+        const buffer = new ArrayBuffer(4 + count * 12);
+        new DataView(buffer).setUint32(0, count, true);
+        const ids = new Int32Array(buffer, 4, count);
+        const positions = new Float32Array(buffer, 4 + count * 4, count * 2);
+        for (let i = 0; i < count; i++) {
+            ids[i] = i + 1;
+            positions[i * 2] = mockCoordinates.coordinates.x[i];
+            positions[i * 2 + 1] = mockCoordinates.coordinates.y[i];
+        }
+        return HttpResponse.arrayBuffer(buffer, { headers: { 'Content-Type': 'application/octet-stream' } });
+    }),
     http.get('/api/database/columns', () => HttpResponse.json(mockColumns)),
     http.post('/api/visualise/get-point', async ({ request }) => {
         const { id } = await request.json();
@@ -49,15 +79,19 @@ export const handlers = [
     http.get('/api/database/health', () => HttpResponse.json({ loaded: mockDatabaseLoaded, name: mockDatabaseName })),
     http.get('/api/visualise/list-databases', () => HttpResponse.json({ databases: mockDatabases, selectedDatabase: mockDatabaseLoaded ? mockDatabaseName : null })),
     http.get('/api/embeddings/check-progress', () => HttpResponse.json({ completedDocuments: mockEmbeddingCompletedCount })),
-    http.post('/api/embedding/queue-embeddings', () => HttpResponse.json({ status: "success" })),
-    http.post('/api/dimension-reduction/run', () => HttpResponse.json({ status: "success" })),
-    http.get('/api/dimension-reduction/check-progress', () => HttpResponse.json({ status: "success", mapVectors: mockMapVectors })),
+    http.post('/api/embedding/queue-embeddings', () => HttpResponse.json({ status: "success", jobId: "mock-embedding-job" })),
+    http.post('/api/dimension-reduction/run', () => HttpResponse.json({ status: "success", jobId: "mock-projection-job" })),
+    http.get('/api/jobs', () => HttpResponse.json({ jobs: [] })),
+    http.post('/api/jobs/:jobId/cancel', () => HttpResponse.json({ status: "cancelling" })),
+    http.get('/api/dimension-reduction/check-progress', () => HttpResponse.json({ status: "success", pointCount: mockMapVectors.x.length })),
     http.post('/api/dimension-reduction/configure', () => HttpResponse.json({ status: "success" })),
     http.post('/api/embeddings/configure', async ({ request }) => {
         const data = await request.json();
         if (!data.embeddingModel) return HttpResponse.json({ status: "pending", message: "model downloading", logs: "" });
         return HttpResponse.json({ status: "success", message: "model loaded" });
     }),
+    http.get('/api/embeddings/backends', () => HttpResponse.json({ backends: ["torch", "torch-int8"] })),
+    http.get('/api/embeddings/cache', () => HttpResponse.json({ entries: 0, sizeBytes: 0, maxBytes: 2147483648, hits: 0, misses: 0, hitRate: null })),
     http.get('/api/embeddings/check-download', () => HttpResponse.json({ model: "mock_model", modelObject: "Object()", logs: "" })),
     http.get('/api/database/preview', () => HttpResponse.json(mockDataPreview)),
     http.get('/api/database/total-documents', () => HttpResponse.json({ totalDocuments: mockTotalDocuments })),
@@ -69,16 +103,21 @@ export const handlers = [
     }),
     http.post('/api/database/upload-file', async ({ request }) => HttpResponse.json({ status: "success" })),
     http.post('/api/visualise/simple-query', async ({ request }) => {
-        const { field, query, operator } = await request.json();
-        return HttpResponse.json([1, 2, 3, 4]);
+        const { field, query, operator, encoding } = await request.json();
+        const ids = [1, 2, 3, 4];
+        return encoding === "binary" ? packIdBitmap(ids) : HttpResponse.json(ids);
     }),
+    http.get('/api/visualise/text-indexes', () => HttpResponse.json({ indexed: [], building: [] })),
+    http.post('/api/visualise/build-text-index', async () => HttpResponse.json({ status: "processing" })),
     http.post('/api/visualise/sequential-query', async ({ request }) => {
-        const { field, buckets } = await request.json();
-        return HttpResponse.json(Array.from({ length: buckets }, (_, i) => [i + 1, i + 2, i + 3]));
+        const { field, buckets, encoding } = await request.json();
+        const groups = Array.from({ length: buckets }, (_, i) => [i * 3 + 1, i * 3 + 2, i * 3 + 3]);
+        return encoding === "binary" ? packBucketNumbers(groups) : HttpResponse.json(groups);
     }),
     http.post('/api/visualise/categorical-query', async ({ request }) => {
-        const { field, buckets } = await request.json();
-        return HttpResponse.json(Array.from({ length: buckets }, () => [1, 2, 3]));
+        const { field, buckets, encoding } = await request.json();
+        const groups = Array.from({ length: buckets }, (_, i) => (i === 0 ? [1, 2, 3] : []));
+        return encoding === "binary" ? packBucketNumbers(groups) : HttpResponse.json(groups);
     }),
     http.get('/shutdown', () => HttpResponse.json({ message: "Server shutting down" })),
 ];
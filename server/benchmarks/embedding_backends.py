@@ -0,0 +1,135 @@
+"""
+Benchmark script comparing encoding throughput and cosine drift
+of the embedder's inference backends against the fp32 torch
+baseline on a fixed corpus.
+
+Run from ./server with `python benchmarks/embedding_backends.py`,
+optionally passing `--corpus` with a text file holding one document
+per line. Backends whose optional dependencies are not installed
+are skipped. ONNX and OpenVINO exports are made on first use and
+cached, so their load time is only representative on the first run.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clients.inference_backends import (  # noqa: E402
+    INFERENCE_BACKEND_REQUIREMENTS,
+    available_backends,
+    load_model,
+)
+
+CORPUS_SEED = 0
+CORPUS_VOCABULARY = (
+    "alert analyst access account activity address admin agent anomaly "
+    "application attacker audit authentication backup beacon binary block "
+    "browser certificate change client cloud command compromise configuration "
+    "connection credential data database delete detection device disk domain "
+    "download email encryption endpoint error event exfiltration execution "
+    "exploit failure file firewall host identity incident indicator install "
+    "integrity kernel key lateral log login machine malware memory message "
+    "network outbound password patch payload permission phishing policy port "
+    "privilege process protocol query ransomware registry remote report "
+    "request response rule scan script server service session signature "
+    "source suspicious system task threat token traffic upload user "
+    "vulnerability warning web workstation"
+).split()
+
+
+def build_corpus(size):
+    """
+    Function to build a deterministic corpus of documents with
+    a spread of lengths.
+    """
+    rng = random.Random(CORPUS_SEED)
+    return [
+        " ".join(
+            rng.choices(CORPUS_VOCABULARY, k=max(3, int(rng.lognormvariate(3, 0.8))))
+        )
+        for _ in range(size)
+    ]
+
+
+def read_corpus(path, size):
+    """
+    Function to read up to size non-empty lines from a file.
+    """
+    with open(path, encoding="utf-8") as fp:
+        documents = [line.strip() for line in fp if line.strip()]
+    return documents[:size]
+
+
+def encode(model, documents, batch_size, repeats):
+    """
+    Function to encode the corpus repeatedly, returning the
+    embeddings and the fastest throughput in documents per second.
+    """
+    model.encode(documents[:batch_size], batch_size=batch_size)
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = model.encode(documents, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return np.asarray(embeddings, dtype="float32"), len(documents) / best
+
+
+def cosine_drift(baseline, embeddings):
+    """
+    Function to get the mean and minimum cosine similarity
+    between each document's baseline and backend embeddings.
+    """
+    baseline = baseline / np.linalg.norm(baseline, axis=1, keepdims=True)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    similarities = np.sum(baseline * embeddings, axis=1)
+    return similarities.mean(), similarities.min()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--corpus")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--backends", nargs="+", default=list(INFERENCE_BACKEND_REQUIREMENTS)
+    )
+    args = parser.parse_args()
+
+    if args.corpus:
+        documents = read_corpus(args.corpus, args.documents)
+    else:
+        documents = build_corpus(args.documents)
+    available = available_backends()
+    print(f"Encoding {len(documents)} documents with {args.model}.")
+    print(
+        f"{'backend':<12} {'load s':>8} {'docs/s':>9} {'speedup':>8} "
+        f"{'mean cos':>9} {'min cos':>9}"
+    )
+    baseline = None
+    baseline_rate = None
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        if backend not in available:
+            missing = ", ".join(INFERENCE_BACKEND_REQUIREMENTS[backend])
+            print(f"{backend:<12} skipped, requires {missing}")
+            continue
+        start = time.perf_counter()
+        model = load_model(args.model, backend)
+        load_seconds = time.perf_counter() - start
+        embeddings, rate = encode(model, documents, args.batch_size, args.repeats)
+        if baseline is None:
+            baseline = embeddings
+            baseline_rate = rate
+        mean_cosine, min_cosine = cosine_drift(baseline, embeddings)
+        print(
+            f"{backend:<12} {load_seconds:8.2f} {rate:9.1f} {rate / baseline_rate:8.2f} "
+            f"{mean_cosine:9.5f} {min_cosine:9.5f}"
+        )
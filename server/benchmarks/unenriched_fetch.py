@@ -0,0 +1,131 @@
+"""
+Benchmark script comparing per-batch latency of the legacy
+`IS NULL LIMIT n` unenriched document fetch against the keyset
+iterator in DatabaseConnector as the table fills with embeddings.
+
+Run from ./server with `python benchmarks/unenriched_fetch.py`.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clients.database_connector import DatabaseConnector  # noqa: E402
+
+STORAGE_FIELD = "text_embedding"
+FAKE_EMBEDDING = bytes(16)
+
+
+def build_database(path, rows):
+    """
+    Function to build a table shaped like an uploaded dataset
+    with an empty embedding column.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE data (_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        f'"text" TEXT, "source" TEXT, "timestamp" TEXT, "{STORAGE_FIELD}" BLOB)'
+    )
+    conn.executemany(
+        'INSERT INTO data ("text", "source", "timestamp") VALUES (?, ?, ?)',
+        (
+            (f"document {i} " * 8, f"source-{i % 97}", f"2024-01-{i % 28 + 1:02d}")
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def mark_embedded(conn, rows):
+    """
+    Function to write placeholder embeddings for a batch.
+    """
+    conn.executemany(
+        f'UPDATE data SET "{STORAGE_FIELD}" = ? WHERE _id = ?',
+        [(FAKE_EMBEDDING, row[0]) for row in rows],
+    )
+    conn.commit()
+
+
+def run_legacy(path, batch_size):
+    """
+    Function to time the legacy fetch, which rescans the table
+    from the start on every batch.
+    """
+    conn = sqlite3.connect(path)
+    latencies = []
+    while True:
+        start = time.perf_counter()
+        rows = conn.execute(
+            f'SELECT * FROM data WHERE "{STORAGE_FIELD}" IS NULL LIMIT {batch_size}'
+        ).fetchall()
+        latencies.append(time.perf_counter() - start)
+        if not rows:
+            break
+        mark_embedded(conn, rows)
+    conn.close()
+    return latencies[:-1]
+
+
+def run_keyset(path, batch_size):
+    """
+    Function to time the keyset iterator used by the embedder.
+    """
+    database_connector = DatabaseConnector(path)
+    conn = sqlite3.connect(path)
+    latencies = []
+    batches = database_connector.iterate_unenriched_documents(
+        STORAGE_FIELD, ["text"], batch_size, after_id=0
+    )
+    while True:
+        start = time.perf_counter()
+        rows = next(batches, None)
+        latencies.append(time.perf_counter() - start)
+        if rows is None:
+            break
+        mark_embedded(conn, [(row["_id"],) for row in rows])
+    conn.close()
+    return latencies[:-1]
+
+
+def summarise(name, latencies, segments):
+    """
+    Function to print mean batch latency for equal segments of
+    the run, from the first batches to the last.
+    """
+    size = max(1, len(latencies) // segments)
+    means = [
+        sum(latencies[i : i + size]) / len(latencies[i : i + size]) * 1000
+        for i in range(0, size * segments, size)
+        if latencies[i : i + size]
+    ]
+    print(f"{name:<8} " + " ".join(f"{mean:8.2f}" for mean in means))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--segments", type=int, default=10)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Building {args.rows} row table...")
+        runs = [("keyset", run_keyset)]
+        if not args.skip_legacy:
+            runs.insert(0, ("legacy", run_legacy))
+        print(
+            "Mean batch latency (ms) per segment, first to last:\n"
+            f"{'':<8} " + " ".join(f"{i + 1:>8}" for i in range(args.segments))
+        )
+        for name, run in runs:
+            path = os.path.join(directory, f"{name}.db")
+            build_database(path, args.rows)
+            summarise(name, run(path, args.batch_size), args.segments)
@@ -2,28 +2,384 @@
 Module to handle slqite3 database connections.
 """
 
+import json
 import logging
 import pickle
 import sqlite3
 import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import numpy as np
+
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_DTYPE = "<f4"
+EMPTY_EMBEDDING = b""
+METADATA_TABLE = "_metadata"
+PROJECTIONS_TABLE = "projections"
+INTERNAL_TABLES = ("sqlite_sequence", METADATA_TABLE, PROJECTIONS_TABLE)
+PROJECTION_DTYPE = "<f4"
+TEXT_INDEX_PREFIX = "_text_index_"
+TEXT_INDEX_MIN_QUERY_LENGTH = 3
+MAX_CATEGORICAL_BUCKETS = 100
+DEFAULT_TRANSACTION_SIZE = 10000
+DATABASE_TIMEOUT_SECONDS = 30
+INGEST_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -262144,
+    "mmap_size": 1073741824,
+}
+
+column_versions = {}
+column_versions_lock = threading.Lock()
+
+
+def apply_ingest_profile(conn):
+    """
+    Function to tune a connection for bulk writes. Switches the
+    database to WAL journaling, which persists in the file, and
+    applies the connection-level INGEST_PRAGMAS. Returns the
+    previous values of those pragmas.
+    """
+    previous = {
+        pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in INGEST_PRAGMAS
+    }
+    conn.execute("PRAGMA journal_mode=WAL")
+    for pragma, value in INGEST_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={value}")
+    return previous
+
+
+def prepare_value(value):
+    """
+    Function to convert a value into a type sqlite3 can bind,
+    stringifying anything else.
+    """
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+def group_by_bucket(ids, bucket_indexes, buckets):
+    """
+    Function to split ids into a list of id lists by bucket
+    index, keeping id order within each bucket. Ids with a
+    negative bucket index are dropped.
+    """
+    keep = bucket_indexes >= 0
+    ids = ids[keep]
+    bucket_indexes = bucket_indexes[keep]
+    order = np.argsort(bucket_indexes, kind="stable")
+    counts = np.bincount(bucket_indexes, minlength=buckets)[:buckets]
+    return [group.tolist() for group in np.split(ids[order], np.cumsum(counts)[:-1])]
+
+
+def categorical_buckets(ids, values, buckets):
+    """
+    Function to bucket ids by the most frequent values of a
+    column in a single pass, treating missing values as a value.
+    """
+    if buckets > MAX_CATEGORICAL_BUCKETS:
+        buckets = MAX_CATEGORICAL_BUCKETS
+        logging.info(f"Bucket count capped at {MAX_CATEGORICAL_BUCKETS}.")
+    if not len(ids):
+        return []
+    codes = {}
+    value_codes = np.fromiter(
+        (codes.setdefault(value, len(codes)) for value in values),
+        dtype="int64",
+        count=len(values),
+    )
+    counts = np.bincount(value_codes)
+    top_codes = np.argsort(-counts, kind="stable")[:buckets]
+    ranks = np.full(len(counts), -1, dtype="int64")
+    ranks[top_codes] = np.arange(len(top_codes))
+    return group_by_bucket(ids, ranks[value_codes], len(top_codes))
+
+
+def sequential_buckets(ids, values, buckets):
+    """
+    Function to bucket ids into equal ranges of a numeric or
+    ISO-formatted date column in a single pass, following
+    SQLite ordering, where numbers sort before text.
+    """
+    numbers = np.fromiter(
+        (isinstance(value, (int, float)) for value in values),
+        dtype=bool,
+        count=len(values),
+    )
+    texts = np.fromiter(
+        (isinstance(value, str) for value in values), dtype=bool, count=len(values)
+    )
+    min_value = (
+        min(values[numbers]) if numbers.any() else min(values[texts], default=None)
+    )
+    max_value = (
+        max(values[texts]) if texts.any() else max(values[numbers], default=None)
+    )
+
+    if min_value is None or max_value is None:
+        return None
+
+    is_date_field = False
+    if isinstance(min_value, str) and len(min_value) >= 10:
+        try:
+            datetime.strptime(min_value[:10], "%Y-%m-%d")
+            is_date_field = True
+        except ValueError:
+            pass
+
+    if is_date_field:
+        start_date = datetime.strptime(min_value[:10], "%Y-%m-%d")
+        end_date = datetime.strptime(max_value[:10], "%Y-%m-%d")
+
+        delta = (end_date - start_date).days
+        interval_days = 1 if delta == 0 else delta / buckets
+        starts = np.array(
+            [
+                (start_date + timedelta(days=int(interval_days * i))).strftime(
+                    "%Y-%m-%d"
+                )
+                for i in range(buckets)
+            ]
+        )
+        keep = texts
+        keyed = np.array(values[keep].tolist(), dtype=str)
+    else:
+        interval_size = (max_value - min_value) / buckets
+        starts = np.array([min_value + (interval_size * i) for i in range(buckets)])
+        keep = numbers
+        keyed = values[keep].astype("float64")
+
+    bucket_indexes = np.searchsorted(starts, keyed, side="right") - 1
+    return group_by_bucket(ids[keep], bucket_indexes, buckets)
+
+
+def encode_embedding(embedding):
+    """
+    Function to serialise an embedding vector into raw
+    little-endian float32 bytes for BLOB storage.
+    """
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
 
 class DatabaseConnector:
     """
-    Class to handle sqlite3 database connections via
-    a single connection and cursor.
+    Class to handle sqlite3 database connections with one
+    connection and cursor per thread. A read-only connector
+    serves concurrent readers, such as the server's request
+    threads, while each background job writes through its own
+    connector. The database is kept in WAL mode so readers are
+    not blocked by a writer.
     """
 
-    def __init__(self, database_filename):
+    def __init__(self, database_filename, read_only=False):
         logging.info("DatabaseConnector initialising.")
         self.database_filename = database_filename
         self.databases_directory = Path(sys.argv[0]).parent / "databases"
-        self.conn = sqlite3.connect(self.databases_directory / database_filename)
-        self.cursor = self.conn.cursor()
+        self.database_path = self.databases_directory / database_filename
+        self.read_only = read_only
+        self.local = threading.local()
+        writer = self.__connect(read_only=False)
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute(
+            f'CREATE TABLE IF NOT EXISTS "{METADATA_TABLE}" (key TEXT PRIMARY KEY, value TEXT)'
+        )
+        writer.execute(
+            f'CREATE TABLE IF NOT EXISTS "{PROJECTIONS_TABLE}" ('
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "embedding_field TEXT, parameters TEXT, created TEXT, "
+            "point_count INTEGER, ids BLOB, coordinates BLOB, "
+            "UNIQUE (embedding_field, parameters))"
+        )
+        writer.commit()
+        if read_only:
+            writer.close()
+        else:
+            self.local.conn = writer
+            self.local.cursor = writer.cursor()
         logging.info("DatabaseConnector initialised.")
 
+    def __connect(self, read_only, check_same_thread=True):
+        """
+        Method to open a new connection to the database.
+        """
+        if read_only:
+            return sqlite3.connect(
+                f"{self.database_path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=DATABASE_TIMEOUT_SECONDS,
+                check_same_thread=check_same_thread,
+            )
+        return sqlite3.connect(
+            self.database_path,
+            timeout=DATABASE_TIMEOUT_SECONDS,
+            check_same_thread=check_same_thread,
+        )
+
+    def __thread_connection(self):
+        """
+        Method to return the calling thread's connection and
+        cursor, opening them on first use.
+        """
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = self.__connect(self.read_only)
+            self.local.cursor = self.local.conn.cursor()
+        return self.local.conn, self.local.cursor
+
+    @property
+    def conn(self):
+        """
+        The connection for the calling thread.
+        """
+        return self.__thread_connection()[0]
+
+    @property
+    def cursor(self):
+        """
+        The cursor for the calling thread's connection.
+        """
+        return self.__thread_connection()[1]
+
+    def close(self):
+        """
+        Method to close the calling thread's connection.
+        """
+        if getattr(self.local, "conn", None) is not None:
+            self.local.conn.close()
+            self.local.conn = None
+
+    @contextmanager
+    def ingest_profile(self, enabled=True):
+        """
+        Context manager to apply the bulk ingest profile to this
+        connection for the duration of a bulk write phase.
+        """
+        if not enabled:
+            yield
+            return
+        logging.info("DatabaseConnector applying ingest profile.")
+        previous = apply_ingest_profile(self.conn)
+        try:
+            yield
+        finally:
+            self.conn.commit()
+            for pragma, value in previous.items():
+                self.conn.execute(f"PRAGMA {pragma}={value}")
+            logging.info("DatabaseConnector restored connection pragmas.")
+
+    def commit(self):
+        """
+        Method to commit the current transaction, then bump the
+        version of each data column written in it.
+        """
+        self.conn.commit()
+        written = getattr(self.local, "written_columns", None)
+        if not written:
+            return
+        with column_versions_lock:
+            versions = column_versions.setdefault(str(self.database_path), {})
+            for column in written:
+                versions[column] = versions.get(column, 0) + 1
+        written.clear()
+
+    def __record_write(self, column):
+        """
+        Method to note that a data column has been written in
+        the current transaction.
+        """
+        if getattr(self.local, "written_columns", None) is None:
+            self.local.written_columns = set()
+        self.local.written_columns.add(column)
+
+    def get_column_versions(self):
+        """
+        Method to get a copy of the version of each data column
+        written by this process, for invalidating cached reads.
+        """
+        with column_versions_lock:
+            return dict(column_versions.get(str(self.database_path), {}))
+
+    def get_metadata(self):
+        """
+        Method to get the database metadata as a dictionary
+        of string keys and values.
+        """
+        self.cursor.execute(f'SELECT key, value FROM "{METADATA_TABLE}"')
+        return {row[0]: row[1] for row in self.cursor.fetchall()}
+
+    def set_metadata(self, values, commit=True):
+        """
+        Method to insert or replace metadata keys.
+        """
+        self.cursor.executemany(
+            f'INSERT OR REPLACE INTO "{METADATA_TABLE}" (key, value) VALUES (?, ?)',
+            [
+                (key, None if value is None else str(value))
+                for key, value in values.items()
+            ],
+        )
+        if commit:
+            self.commit()
+
+    def write_embedding_metadata(self, storage_field, model, dimension):
+        """
+        Method to record the storage format of the embedding field,
+        and the model its embeddings belong to.
+        """
+        logging.info("DatabaseConnector writing embedding metadata.")
+        self.set_metadata(
+            {
+                "embedding_format_version": EMBEDDING_FORMAT_VERSION,
+                "embedding_field": storage_field,
+                "embedding_dtype": EMBEDDING_DTYPE,
+                "embedding_dimension": dimension,
+                "embedding_model": model,
+                f"embedding_dimension.{storage_field}": dimension,
+                f"embedding_model.{storage_field}": model,
+            }
+        )
+
+    def get_embedding_model(self, storage_field):
+        """
+        Method to get the model and dimension recorded for the
+        embeddings stored in a field. Either is None if unknown.
+        """
+        metadata = self.get_metadata()
+        model = metadata.get(f"embedding_model.{storage_field}")
+        dimension = metadata.get(f"embedding_dimension.{storage_field}")
+        if (
+            model is None
+            and dimension is None
+            and metadata.get("embedding_field") == storage_field
+        ):
+            model = metadata.get("embedding_model")
+            dimension = metadata.get("embedding_dimension")
+        return model, int(dimension) if dimension else None
+
+    def clear_embeddings(self, storage_field):
+        """
+        Method to discard the embeddings stored in a field and
+        reset the embedding checkpoint and sidecar, so the field
+        is embedded again from the start.
+        """
+        logging.info("DatabaseConnector clearing embeddings.")
+        self.cursor.execute(f'UPDATE data SET "{storage_field}" = NULL')
+        self.__record_write(storage_field)
+        self.set_metadata(
+            {
+                f"embedding_checkpoint.{storage_field}": 0,
+                "embedding_sidecar_rows": None,
+                "embedding_sidecar_field": None,
+            },
+            commit=False,
+        )
+        self.commit()
+        logging.info("DatabaseConnector cleared embeddings.")
+
     def preview_data(self):
         """
         Method to preview the first 10 rows of the database
@@ -56,20 +412,59 @@ class DatabaseConnector:
         logging.info("DatabaseConnector returning total documents.")
         return total_documents
 
-    def get_unenriched_documents(self, embedding_field, count):
+    def get_unenriched_documents(self, embedding_field, count, after_id=0, fields=None):
         """
         Method to get the first n documents that are not
-        enriched.
+        enriched and have an _id greater than after_id,
+        in primary key order. If fields is given only _id
+        and those fields are selected.
         """
         logging.info("DatabaseConnector getting unenriched documents.")
+        if fields:
+            selected = ", ".join(["_id"] + [f'"{field}"' for field in fields])
+        else:
+            selected = "*"
         self.cursor.execute(
-            f'SELECT * FROM data WHERE "{embedding_field}" IS NULL LIMIT {count}'
+            f"SELECT {selected} FROM data "
+            f'WHERE _id > ? AND "{embedding_field}" IS NULL ORDER BY _id LIMIT ?',
+            (after_id, count),
         )
         columns = [description[0] for description in self.cursor.description]
         data = [dict(zip(columns, row)) for row in self.cursor.fetchall()]
         logging.info("DatabaseConnector returning unenriched documents.")
         return data
 
+    def iterate_unenriched_documents(
+        self, embedding_field, fields, batch_size, after_id=None
+    ):
+        """
+        Method to yield batches of unenriched documents by walking
+        _id in primary key order. Each query seeks past the last
+        _id seen, so batch latency stays flat however much of the
+        table is already enriched. If after_id is not given the
+        walk resumes from the field's persisted embedding checkpoint.
+        """
+        if after_id is None:
+            after_id = self.get_embedding_checkpoint(embedding_field)
+        while True:
+            rows = self.get_unenriched_documents(
+                embedding_field, batch_size, after_id=after_id, fields=fields
+            )
+            if not rows:
+                return
+            after_id = rows[-1]["_id"]
+            yield rows
+
+    def get_embedding_checkpoint(self, storage_field):
+        """
+        Method to get the _id up to which every document has
+        been enriched in a field, as recorded by
+        write_embedded_documents.
+        """
+        return int(
+            self.get_metadata().get(f"embedding_checkpoint.{storage_field}") or 0
+        )
+
     def create_field_to_store_embeddings(self, field_name):
         """
         Method to create a field in the database to store
@@ -78,22 +473,37 @@ class DatabaseConnector:
         logging.info("DatabaseConnector creating field to store embeddings.")
         if not field_name.endswith("_embedding"):
             field_name += "_embedding"
+        if field_name in self.get_columns():
+            logging.info("DatabaseConnector field to store embeddings exists.")
+            return field_name
         self.cursor.execute(f'ALTER TABLE data ADD COLUMN "{field_name}" BLOB')
+        self.set_metadata({f"embedding_checkpoint.{field_name}": 0}, commit=False)
         self.conn.commit()
         logging.info("DatabaseConnector created field to store embeddings.")
         return field_name
 
-    def write_embedded_documents(self, documents, storage_field):
+    def write_embedded_documents(
+        self, documents, storage_field, checkpoint=None, commit=True
+    ):
         """
-        Method to write enriched documents to the database.
+        Method to write enriched documents to the database. If
+        checkpoint is given it is persisted in the same
+        transaction so an interrupted run can resume from it.
+        Callers batching several writes into one transaction
+        pass commit=False and call commit themselves.
         """
         logging.info("DatabaseConnector writing enriched documents.")
-        for document in documents:
-            self.cursor.execute(
-                f'UPDATE data SET "{storage_field}" = ? WHERE _id = ?',
-                (document[storage_field], document["_id"]),
+        self.cursor.executemany(
+            f'UPDATE data SET "{storage_field}" = ? WHERE _id = ?',
+            [(document[storage_field], document["_id"]) for document in documents],
+        )
+        self.__record_write(storage_field)
+        if checkpoint is not None:
+            self.set_metadata(
+                {f"embedding_checkpoint.{storage_field}": checkpoint}, commit=False
             )
-        self.conn.commit()
+        if commit:
+            self.commit()
         logging.info("DatabaseConnector wrote enriched documents.")
 
     def get_completed_document_count(self, storage_field):
@@ -109,52 +519,334 @@ class DatabaseConnector:
         logging.info("DatabaseConnector returning completed document count.")
         return completed_document_count
 
-    def get_embeddings(self):
+    def get_embedded_document_count(self, storage_field):
         """
-        Method to get the embeddings from the database.
+        Method to get the number of completed documents that
+        have an embedding, leaving out those stored as
+        EMPTY_EMBEDDING because they had no text.
         """
-        logging.info("DatabaseConnector getting embeddings.")
-        self.cursor.execute("SELECT * FROM data")
-        columns = [description[0] for description in self.cursor.description]
+        self.cursor.execute(
+            f'SELECT COUNT(*) FROM data WHERE LENGTH("{storage_field}") > 0'
+        )
+        return self.cursor.fetchone()[0]
+
+    def get_empty_embedding_ids(self, storage_field):
+        """
+        Method to get the ids of documents stored with
+        EMPTY_EMBEDDING because they had no text.
+        """
+        self.cursor.execute(
+            f'SELECT _id FROM data WHERE LENGTH("{storage_field}") = 0 ORDER BY _id'
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def get_embedding_field(self):
+        """
+        Method to get the name of the field storing embeddings.
+        """
+        embedding_field = self.get_metadata().get("embedding_field")
+        if embedding_field:
+            return embedding_field
         embedding_field = next(
-            (col for col in columns if col.endswith("_embedding")), None
+            (col for col in self.get_columns() if col.endswith("_embedding")), None
         )
         if not embedding_field:
             logging.error("DatabaseConnector could not find embedding field.")
             raise ValueError("DatabaseConnector could not find embedding field.")
+        return embedding_field
 
-        self.cursor.execute(f'SELECT _id, "{embedding_field}" FROM data')
-        data = self.cursor.fetchall()
-        embeddings_dict = {}
-        for row in data:
-            id_val = row[0]
-            embedding_blob = row[1]
-            if embedding_blob is not None:
-                try:
-                    embedding = pickle.loads(embedding_blob)
-                    embeddings_dict[id_val] = embedding
-                except Exception as e:
-                    logging.error(f"Error deserializing embedding for ID {id_val}: {e}")
-                    embeddings_dict[id_val] = None
-            else:
-                embeddings_dict[id_val] = None
+    def migrate_pickled_embeddings(self, storage_field, batch_size=1000):
+        """
+        Method to convert embeddings stored as per-row pickles
+        into the raw float32 layout and record the format in the
+        metadata table. Rows are converted in primary key order
+        in batches within a single transaction, so an interrupted
+        migration leaves no partially converted rows behind.
+        """
+        logging.info("DatabaseConnector migrating pickled embeddings.")
+        dimension = None
+        last_id = 0
+        while True:
+            self.cursor.execute(
+                f'SELECT _id, "{storage_field}" FROM data '
+                f'WHERE _id > ? AND "{storage_field}" IS NOT NULL '
+                "ORDER BY _id LIMIT ?",
+                (last_id, batch_size),
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+            updates = []
+            for id_val, embedding_blob in rows:
+                embedding = np.asarray(
+                    pickle.loads(embedding_blob), dtype=EMBEDDING_DTYPE
+                )
+                dimension = embedding.shape[0]
+                updates.append((embedding.tobytes(), id_val))
+            self.cursor.executemany(
+                f'UPDATE data SET "{storage_field}" = ? WHERE _id = ?', updates
+            )
+            self.__record_write(storage_field)
+            last_id = rows[-1][0]
+        self.write_embedding_metadata(storage_field, None, dimension)
+        logging.info("DatabaseConnector migrated pickled embeddings.")
+
+    def get_sidecar_paths(self):
+        """
+        Method to get the paths of the embedding and id sidecar
+        files stored next to the database file.
+        """
+        stem = Path(self.database_filename).stem
+        return (
+            self.databases_directory / f"{stem}.embeddings.npy",
+            self.databases_directory / f"{stem}.ids.npy",
+        )
+
+    def get_index_paths(self):
+        """
+        Method to get the paths of the serialised FAISS index
+        and the ids of its rows, stored next to the database file.
+        """
+        stem = Path(self.database_filename).stem
+        return (
+            self.databases_directory / f"{stem}.faiss",
+            self.databases_directory / f"{stem}.faiss_ids.npy",
+        )
+
+    def create_embedding_sidecar(self, storage_field, count, dimension, resume=False):
+        """
+        Method to create memory-mapped .npy sidecar files sized
+        for the given number of embeddings of a field. Returns a
+        tuple of the writable id and embedding arrays. If resume
+        is set, sidecar files of matching shape last written for
+        the same field are reopened for writing instead of being
+        recreated, and None is returned if there are none to
+        reopen.
+        """
+        logging.info("DatabaseConnector creating embedding sidecar.")
+        previous_field = self.get_metadata().get("embedding_sidecar_field")
+        self.set_metadata(
+            {"embedding_sidecar_rows": None, "embedding_sidecar_field": storage_field}
+        )
+        embeddings_path, ids_path = self.get_sidecar_paths()
+        if resume:
+            if (
+                previous_field == storage_field
+                and embeddings_path.exists()
+                and ids_path.exists()
+            ):
+                embeddings = np.load(embeddings_path, mmap_mode="r+")
+                ids = np.load(ids_path, mmap_mode="r+")
+                if embeddings.shape == (count, dimension) and ids.shape == (count,):
+                    logging.info("DatabaseConnector reopened embedding sidecar.")
+                    return ids, embeddings
+            logging.info("DatabaseConnector could not reopen embedding sidecar.")
+            return None
+        embeddings = np.lib.format.open_memmap(
+            embeddings_path, mode="w+", dtype=EMBEDDING_DTYPE, shape=(count, dimension)
+        )
+        ids = np.lib.format.open_memmap(
+            ids_path, mode="w+", dtype=np.int64, shape=(count,)
+        )
+        logging.info("DatabaseConnector created embedding sidecar.")
+        return ids, embeddings
+
+    def complete_embedding_sidecar(self, ids, embeddings, rows):
+        """
+        Method to flush the sidecar arrays and mark the first
+        rows entries as valid.
+        """
+        ids.flush()
+        embeddings.flush()
+        self.set_metadata({"embedding_sidecar_rows": rows})
+        logging.info("DatabaseConnector completed embedding sidecar.")
+
+    def open_embedding_sidecar(self):
+        """
+        Method to open the sidecar files as read-only memory maps.
+        Returns None if the sidecar is missing, incomplete, holds
+        another field or is out of step with the embeddings stored
+        in the database.
+        """
+        metadata = self.get_metadata()
+        rows = metadata.get("embedding_sidecar_rows")
+        embedding_field = self.get_embedding_field()
+        sidecar_field = metadata.get("embedding_sidecar_field")
+        embeddings_path, ids_path = self.get_sidecar_paths()
+        if rows is None or not embeddings_path.exists() or not ids_path.exists():
+            return None
+        if sidecar_field is not None and sidecar_field != embedding_field:
+            logging.info("DatabaseConnector embedding sidecar holds another field.")
+            return None
+        rows = int(rows)
+        if rows != self.get_embedded_document_count(embedding_field):
+            logging.info("DatabaseConnector embedding sidecar is stale.")
+            return None
+        ids = np.load(ids_path, mmap_mode="r")[:rows]
+        embeddings = np.load(embeddings_path, mmap_mode="r")[:rows]
+        return ids, embeddings
+
+    def get_embeddings(self, use_sidecar=True):
+        """
+        Method to get the embeddings from the database as a
+        tuple of an id array and a contiguous (n, d) float32
+        array, ordered by _id. If a complete sidecar exists the
+        arrays are read-only memory maps of the sidecar files.
+        Documents stored with EMPTY_EMBEDDING are left out.
+        Databases created before the float32 layout are migrated
+        first.
+        """
+        logging.info("DatabaseConnector getting embeddings.")
+        if use_sidecar:
+            sidecar = self.open_embedding_sidecar()
+            if sidecar is not None:
+                logging.info("DatabaseConnector returning memory-mapped embeddings.")
+                return sidecar
+        embedding_field = self.get_embedding_field()
+        metadata = self.get_metadata()
+        if metadata.get("embedding_format_version") is None:
+            self.migrate_pickled_embeddings(embedding_field)
+            metadata = self.get_metadata()
+
+        count = self.get_embedded_document_count(embedding_field)
+        dimension = int(metadata.get("embedding_dimension") or 0)
+        if not dimension and count:
+            self.cursor.execute(
+                f'SELECT LENGTH("{embedding_field}") FROM data '
+                f'WHERE LENGTH("{embedding_field}") > 0 LIMIT 1'
+            )
+            dimension = self.cursor.fetchone()[0] // np.dtype(EMBEDDING_DTYPE).itemsize
+        row_bytes = dimension * np.dtype(EMBEDDING_DTYPE).itemsize
+
+        ids = np.empty(count, dtype=np.int64)
+        buffer = bytearray(count * row_bytes)
+        view = memoryview(buffer)
+        self.cursor.execute(
+            f'SELECT _id, "{embedding_field}" FROM data '
+            f'WHERE LENGTH("{embedding_field}") > 0 ORDER BY _id'
+        )
+        for i, (id_val, embedding_blob) in enumerate(self.cursor):
+            if len(embedding_blob) != row_bytes:
+                logging.error(
+                    "DatabaseConnector embedding for ID %s has unexpected size.", id_val
+                )
+                raise ValueError(f"Embedding for ID {id_val} has unexpected size.")
+            ids[i] = id_val
+            view[i * row_bytes : (i + 1) * row_bytes] = embedding_blob
+        embeddings = np.frombuffer(buffer, dtype=EMBEDDING_DTYPE).reshape(
+            count, dimension
+        )
         logging.info("DatabaseConnector returning embeddings.")
-        return embeddings_dict
+        return ids, embeddings
+
+    def save_projection(self, embedding_field, parameters, ids, coordinates):
+        """
+        Method to store projected coordinates keyed by embedding
+        field and reducer parameters, updating any projection
+        with the same key in place so it keeps its id. Returns
+        the projection id.
+        """
+        logging.info("DatabaseConnector saving projection.")
+        ids = np.asarray(ids, dtype="<i8")
+        coordinates = np.asarray(coordinates, dtype=PROJECTION_DTYPE)
+        parameters = json.dumps(parameters, sort_keys=True)
+        self.cursor.execute(
+            f'INSERT INTO "{PROJECTIONS_TABLE}" '
+            "(embedding_field, parameters, created, point_count, ids, coordinates) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (embedding_field, parameters) DO UPDATE SET "
+            "created = excluded.created, point_count = excluded.point_count, "
+            "ids = excluded.ids, coordinates = excluded.coordinates",
+            (
+                embedding_field,
+                parameters,
+                datetime.now().isoformat(timespec="seconds"),
+                len(ids),
+                ids.tobytes(),
+                coordinates.tobytes(),
+            ),
+        )
+        self.conn.commit()
+        self.cursor.execute(
+            f'SELECT id FROM "{PROJECTIONS_TABLE}" '
+            "WHERE embedding_field = ? AND parameters = ?",
+            (embedding_field, parameters),
+        )
+        return self.cursor.fetchone()[0]
+
+    def get_projection_model_prefix(self, projection_id):
+        """
+        Method to get the path prefix of the saved reducer
+        model for a projection, stored next to the database file.
+        """
+        stem = Path(self.database_filename).stem
+        return str(self.databases_directory / f"{stem}.projection-{projection_id}")
+
+    def list_projections(self):
+        """
+        Method to list stored projections without their
+        coordinates, most recent first.
+        """
+        self.cursor.execute(
+            "SELECT id, embedding_field, parameters, created, point_count "
+            f'FROM "{PROJECTIONS_TABLE}" ORDER BY created DESC, id DESC'
+        )
+        return [
+            {
+                "id": row[0],
+                "embeddingField": row[1],
+                "parameters": json.loads(row[2]),
+                "created": row[3],
+                "pointCount": row[4],
+            }
+            for row in self.cursor.fetchall()
+        ]
+
+    def load_projection(self, projection_id=None):
+        """
+        Method to load a stored projection by id, or the most
+        recent projection if no id is given. Returns a tuple of
+        the projection id, its reducer parameters, an int64 id
+        array and an (n, 2) float32 coordinate array, or None if
+        there is no match.
+        """
+        query = f'SELECT id, parameters, ids, coordinates FROM "{PROJECTIONS_TABLE}" '
+        if projection_id is None:
+            self.cursor.execute(query + "ORDER BY created DESC, id DESC LIMIT 1")
+        else:
+            self.cursor.execute(query + "WHERE id = ?", (projection_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        logging.info("DatabaseConnector loaded projection %s.", row[0])
+        ids = np.frombuffer(row[2], dtype="<i8")
+        coordinates = np.frombuffer(row[3], dtype=PROJECTION_DTYPE).reshape(-1, 2)
+        return row[0], json.loads(row[1]), ids, coordinates
 
     def create_nearest_neighbours_column(self):
         logging.info("DatabaseConnector creating field to store nearest neighbours.")
+        if "_nearest_neighbours" in self.get_columns():
+            logging.info("DatabaseConnector field to store nearest neighbours exists.")
+            return
         self.cursor.execute(f'ALTER TABLE data ADD COLUMN "_nearest_neighbours" TEXT')
         self.conn.commit()
         logging.info("DatabaseConnector created field to store nearest neighbours.")
 
-    def write_nearest_neighbours(self, updates):
+    def write_nearest_neighbours(
+        self, updates, transaction_size=DEFAULT_TRANSACTION_SIZE
+    ):
+        """
+        Method to write a list of (neighbours, _id) tuples,
+        committing every transaction_size rows.
+        """
         logging.info("DatabaseConnector writing nearest neighbours.")
-        for update in updates:
-            self.cursor.execute(
+        for start in range(0, len(updates), transaction_size):
+            self.cursor.executemany(
                 'UPDATE data SET "_nearest_neighbours" = ? WHERE _id = ?',
-                (update["neighbours"], update["_id"]),
+                updates[start : start + transaction_size],
             )
-        self.conn.commit()
+            self.__record_write("_nearest_neighbours")
+            self.commit()
         logging.info("DatabaseConnector wrote nearest neighbours.")
 
     def is_nearest_neighbours_complete(self):
@@ -179,10 +871,25 @@ class DatabaseConnector:
         logging.info("DatabaseConnector nearest neighbours complete: %s", is_complete)
         return is_complete
 
+    def get_nearest_neighbours(self):
+        """
+        Method to get the stored nearest neighbours of every
+        document as a dictionary of _id to a list of neighbour
+        ids. Returns None if neighbours have not been computed.
+        """
+        if "_nearest_neighbours" not in self.get_columns():
+            return None
+        self.cursor.execute(
+            'SELECT _id, "_nearest_neighbours" FROM data '
+            'WHERE "_nearest_neighbours" IS NOT NULL'
+        )
+        return {row[0]: json.loads(row[1]) for row in self.cursor}
+
     def get_data_by_id(self, id):
         """
         Method to get data by ID from the database,
-        except for the embedding field.
+        except for the embedding field. The stored neighbour
+        graph is cut to the configured near neighbour count.
         """
         logging.info("DatabaseConnector getting data by ID.")
         self.cursor.execute("SELECT * FROM data WHERE _id = ?", (id,))
@@ -193,9 +900,56 @@ class DatabaseConnector:
         )
         if embedding_field:
             del data[embedding_field]
+        neighbour_count = self.get_metadata().get("near_neighbour_count")
+        if neighbour_count and data.get("_nearest_neighbours"):
+            data["_nearest_neighbours"] = json.dumps(
+                json.loads(data["_nearest_neighbours"])[: int(neighbour_count)]
+            )
         logging.info("DatabaseConnector returning data by ID.")
         return data
 
+    def get_text_indexes(self):
+        """
+        Method to get the fields with a completed trigram text index.
+        """
+        return json.loads(self.get_metadata().get("text_indexes") or "[]")
+
+    def create_text_index(self, field):
+        """
+        Method to build an SQLite FTS5 trigram index over a text field
+        so contains queries avoid a full table scan. Triggers keep the
+        index in step with later writes to the field.
+        """
+        logging.info(f"DatabaseConnector building text index for '{field}'.")
+        if field not in self.get_columns():
+            logging.error(f"Column '{field}' does not exist.")
+            raise ValueError(f"Column '{field}' does not exist in table 'data'.")
+        index = f"{TEXT_INDEX_PREFIX}{field}"
+        self.cursor.execute(f'DROP TABLE IF EXISTS "{index}"')
+        self.cursor.execute(
+            f'CREATE VIRTUAL TABLE "{index}" USING fts5("{field}", '
+            "content='data', content_rowid='_id', tokenize='trigram')"
+        )
+        self.cursor.execute(f'INSERT INTO "{index}" ("{index}") VALUES (\'rebuild\')')
+        self.cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_insert" AFTER INSERT ON data BEGIN '
+            f'INSERT INTO "{index}" (rowid, "{field}") VALUES (new._id, new."{field}"); END'
+        )
+        self.cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_delete" AFTER DELETE ON data BEGIN '
+            f'INSERT INTO "{index}" ("{index}", rowid, "{field}") '
+            f"VALUES ('delete', old._id, old.\"{field}\"); END"
+        )
+        self.cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS "{index}_update" AFTER UPDATE OF "{field}" ON data BEGIN '
+            f'INSERT INTO "{index}" ("{index}", rowid, "{field}") '
+            f"VALUES ('delete', old._id, old.\"{field}\"); "
+            f'INSERT INTO "{index}" (rowid, "{field}") VALUES (new._id, new."{field}"); END'
+        )
+        indexes = sorted(set(self.get_text_indexes()) | {field})
+        self.set_metadata({"text_indexes": json.dumps(indexes)})
+        logging.info(f"DatabaseConnector built text index for '{field}'.")
+
     def simple_query(self, field, query, operator):
         """
         Method to execute a simple query using a field, query, and
@@ -207,6 +961,20 @@ class DatabaseConnector:
             self.cursor.execute(f'SELECT _id FROM data WHERE "{field}" = ?', (query,))
         elif operator == "not equals":
             self.cursor.execute(f'SELECT _id FROM data WHERE "{field}" != ?', (query,))
+        elif operator in ("contains", "not contains") and (
+            len(query) >= TEXT_INDEX_MIN_QUERY_LENGTH
+            and field in self.get_text_indexes()
+        ):
+            index = f"{TEXT_INDEX_PREFIX}{field}"
+            matches = f'SELECT rowid FROM "{index}" WHERE "{field}" LIKE ?'
+            if operator == "contains":
+                self.cursor.execute(f"{matches} ORDER BY rowid", (f"%{query}%",))
+            else:
+                self.cursor.execute(
+                    f'SELECT _id FROM data WHERE "{field}" IS NOT NULL '
+                    f"AND _id NOT IN ({matches})",
+                    (f"%{query}%",),
+                )
         elif operator == "contains":
             self.cursor.execute(
                 f'SELECT _id FROM data WHERE "{field}" LIKE ?', (f"%{query}%",)
@@ -231,81 +999,14 @@ class DatabaseConnector:
         the specified sequential field into a specified number of buckets.
         Works with both numeric fields and ISO-formatted date strings.
         """
-        from datetime import timedelta
-
         logging.info(
             f"DatabaseConnector executing sequential query with {buckets} buckets."
         )
-
-        self.cursor.execute(f'SELECT MIN("{field}"), MAX("{field}") FROM data')
-        min_value, max_value = self.cursor.fetchone()
-
-        if min_value is None or max_value is None:
+        ids, values = self.get_column_arrays(field)
+        results = sequential_buckets(ids, values, buckets)
+        if results is None:
             logging.warning(f"No data found for field '{field}'.")
             return [[] for _ in range(buckets)]
-
-        is_date_field = False
-        if isinstance(min_value, str) and len(min_value) >= 10:
-            try:
-                datetime.strptime(min_value[:10], "%Y-%m-%d")
-                is_date_field = True
-            except ValueError:
-                pass
-
-        results = []
-
-        if is_date_field:
-            start_date = datetime.strptime(min_value[:10], "%Y-%m-%d")
-            end_date = datetime.strptime(max_value[:10], "%Y-%m-%d")
-
-            delta = (end_date - start_date).days
-            if delta == 0:
-                interval_days = 1
-            else:
-                interval_days = delta / buckets
-
-            for i in range(buckets):
-                bucket_start_date = start_date + timedelta(days=int(interval_days * i))
-                bucket_start_str = bucket_start_date.strftime("%Y-%m-%d")
-
-                if i < buckets - 1:
-                    bucket_end_date = start_date + timedelta(
-                        days=int(interval_days * (i + 1))
-                    )
-                    bucket_end_str = bucket_end_date.strftime("%Y-%m-%d")
-                    self.cursor.execute(
-                        f'SELECT _id FROM data WHERE "{field}" >= ? AND "{field}" < ?',
-                        (bucket_start_str, bucket_end_str),
-                    )
-                else:
-                    self.cursor.execute(
-                        f'SELECT _id FROM data WHERE "{field}" >= ? AND "{field}" <= ?',
-                        (bucket_start_str, max_value),
-                    )
-
-                bucket_ids = [row[0] for row in self.cursor.fetchall()]
-                results.append(bucket_ids)
-        else:
-            interval_size = (max_value - min_value) / buckets
-
-            for i in range(buckets):
-                start_value = min_value + (interval_size * i)
-
-                if i < buckets - 1:
-                    end_value = min_value + (interval_size * (i + 1))
-                    self.cursor.execute(
-                        f'SELECT _id FROM data WHERE "{field}" >= ? AND "{field}" < ?',
-                        (start_value, end_value),
-                    )
-                else:
-                    self.cursor.execute(
-                        f'SELECT _id FROM data WHERE "{field}" >= ? AND "{field}" <= ?',
-                        (start_value, max_value),
-                    )
-
-                bucket_ids = [row[0] for row in self.cursor.fetchall()]
-                results.append(bucket_ids)
-
         logging.info(
             f"DatabaseConnector returning {buckets} buckets from sequential query."
         )
@@ -320,38 +1021,32 @@ class DatabaseConnector:
         logging.info(
             f"DatabaseConnector executing categorical query with {buckets} buckets."
         )
-        if buckets > 100:
-            buckets = 100
-            logging.info("Bucket count capped at 100.")
-
-        self.cursor.execute(
-            f'SELECT "{field}", COUNT(*) as count FROM data GROUP BY "{field}" ORDER BY count DESC'
-        )
-        value_counts = self.cursor.fetchall()
-
-        if not value_counts:
+        ids, values = self.get_column_arrays(field)
+        results = categorical_buckets(ids, values, buckets)
+        if not results:
             logging.warning(f"No data found for field '{field}'.")
-            return []
-
-        top_values = value_counts[:buckets]
-        results = []
-
-        for value, _ in top_values:
-            if value is None:
-                self.cursor.execute(f'SELECT _id FROM data WHERE "{field}" IS NULL')
-            else:
-                self.cursor.execute(
-                    f'SELECT _id FROM data WHERE "{field}" = ?', (value,)
-                )
-
-            bucket_ids = [row[0] for row in self.cursor.fetchall()]
-            results.append(bucket_ids)
-
         logging.info(
             f"DatabaseConnector returning {len(results)} buckets from categorical query."
         )
         return results
 
+    def get_column_arrays(self, column_name):
+        """
+        Method to get all values of a given column as a pair of
+        NumPy arrays of ids and values in id order.
+        """
+        logging.info(f"DatabaseConnector loading column '{column_name}'.")
+        try:
+            self.cursor.execute(f'SELECT _id, "{column_name}" FROM data ORDER BY _id')
+        except sqlite3.OperationalError as e:
+            logging.error(f"Column '{column_name}' does not exist: {e}")
+            raise ValueError(f"Column '{column_name}' does not exist in table 'data'.")
+        rows = self.cursor.fetchall()
+        ids = np.fromiter((row[0] for row in rows), dtype="int64", count=len(rows))
+        values = np.empty(len(rows), dtype=object)
+        values[:] = [row[1] for row in rows]
+        return ids, values
+
     def get_column_values_by_id(self, column_name):
         """
         Method to get all values of a given column, keyed by _id.
@@ -410,7 +1105,9 @@ class DatabaseCreator:
                 for table in tables:
                     table_name = table[0]
 
-                    if table_name == "sqlite_sequence":
+                    if table_name in INTERNAL_TABLES or table_name.startswith(
+                        TEXT_INDEX_PREFIX
+                    ):
                         continue
 
                     cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
@@ -436,9 +1133,38 @@ class DatabaseCreator:
         logging.info("DatabaseCreator returning detailed list of databases.")
         return result
 
-    def create_new_database(self, source_filename, data_list):
+    def create_new_database(
+        self,
+        source_filename,
+        data_list,
+        transaction_size=DEFAULT_TRANSACTION_SIZE,
+        ingest_profile=False,
+    ):
         """
         Method to create a new database file from a list of dictionaries.
+        Rows are inserted with one prepared statement, committing every
+        transaction_size rows.
+        """
+        if not data_list:
+            logging.error("DatabaseCreator received empty data_list.")
+            raise ValueError("DatabaseCreator received empty data_list.")
+        return self.create_database_from_chunks(
+            source_filename,
+            (
+                data_list[start : start + transaction_size]
+                for start in range(0, len(data_list), transaction_size)
+            ),
+            ingest_profile=ingest_profile,
+        )
+
+    def create_database_from_chunks(
+        self, source_filename, chunks, ingest_profile=False
+    ):
+        """
+        Method to create a new database file from an iterable of lists
+        of dictionaries. Each chunk is inserted and committed as it
+        arrives, so only one chunk needs to be held in memory. Keys
+        first seen in a later chunk are added as new columns.
         """
         logging.info("DatabaseCreator creating new database file.")
         filename = f"{source_filename.split('.')[0]}-{datetime.now().strftime('%Y%m%d%H%M%S')}.db"
@@ -446,39 +1172,58 @@ class DatabaseCreator:
 
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
-
-        if not data_list:
-            logging.error("DatabaseCreator received empty data_list.")
-            raise ValueError("DatabaseCreator received empty data_list.")
-
-        columns = list(data_list[0].keys())
-        columns_escaped = [f'"{col}"' for col in columns]
+        if ingest_profile:
+            apply_ingest_profile(conn)
 
         table_name = "data"
-        create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                _id INTEGER PRIMARY KEY AUTOINCREMENT,
-                {', '.join([f"{col} TEXT" for col in columns_escaped])}
-            )
-        """
-        cursor.execute(create_table_query)
-
-        for data_row in data_list:
-            processed_row = {}
-            for k, v in data_row.items():
-                if v is None or isinstance(v, (int, float, str, bytes)):
-                    processed_row[k] = v
+        columns = []
+        seen_columns = set()
+        try:
+            for chunk in chunks:
+                new_columns = []
+                for data_row in chunk:
+                    for col in data_row:
+                        if col not in seen_columns:
+                            seen_columns.add(col)
+                            new_columns.append(col)
+                if new_columns and not columns:
+                    create_table_query = f"""
+                        CREATE TABLE IF NOT EXISTS {table_name} (
+                            _id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            {', '.join([f'"{col}" TEXT' for col in new_columns])}
+                        )
+                    """
+                    cursor.execute(create_table_query)
                 else:
-                    processed_row[k] = str(v)
-
-            placeholders = ", ".join(["?"] * len(processed_row))
-            insert_query = f"""
-                INSERT INTO {table_name} ({', '.join(columns_escaped)}) 
-                VALUES ({placeholders})
-            """
-            cursor.execute(insert_query, tuple(processed_row.values()))
-
-        conn.commit()
+                    for col in new_columns:
+                        cursor.execute(
+                            f'ALTER TABLE {table_name} ADD COLUMN "{col}" TEXT'
+                        )
+                if new_columns:
+                    columns.extend(new_columns)
+                    placeholders = ", ".join(["?"] * len(columns))
+                    insert_query = f"""
+                        INSERT INTO {table_name} ({', '.join([f'"{col}"' for col in columns])}) 
+                        VALUES ({placeholders})
+                    """
+                if not chunk or not columns:
+                    continue
+                cursor.executemany(
+                    insert_query,
+                    (
+                        tuple(prepare_value(data_row.get(col)) for col in columns)
+                        for data_row in chunk
+                    ),
+                )
+                conn.commit()
+
+            if not columns:
+                logging.error("DatabaseCreator received no rows.")
+                raise ValueError("DatabaseCreator received no rows.")
+        except Exception:
+            conn.close()
+            db_path.unlink(missing_ok=True)
+            raise
         conn.close()
 
         logging.info("DatabaseCreator created file %s.", filename)
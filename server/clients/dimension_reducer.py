@@ -3,10 +3,24 @@ Module to handle dimension reduction.
 """
 
 import logging
+import time
+import tracemalloc
 
-from pacmap import PaCMAP
+import faiss
+import numpy as np
 
 from clients.database_connector import DatabaseConnector
+from clients.projection_backends import (
+    backend_exists,
+    create_backend,
+    load_backend,
+    pacmap_neighbour_count,
+)
+
+PROGRESSIVE_CHUNK_SIZE = 20000
+NEIGHBOUR_SEARCH_CHUNK_SIZE = 10000
+NEIGHBOUR_SEARCH_MARGIN = 5
+EXACT_NEIGHBOUR_SEARCH_MAX_POINTS = 20000
 
 
 class DimensionReducer:
@@ -21,6 +35,12 @@ class DimensionReducer:
         FP_ratio=0.5,
         init="pca",
         normalise_range=(200, 200),
+        progressive_sample_size=None,
+        progressive_chunk_size=PROGRESSIVE_CHUNK_SIZE,
+        method="pacmap",
+        pre_components=None,
+        reuse_neighbours=True,
+        measure_memory=False,
     ):
         logging.info("DimensionReducer initialising.")
         self.n_neighbours = n_neighbours
@@ -28,56 +48,434 @@ class DimensionReducer:
         self.FP_ratio = FP_ratio
         self.init = init
         self.normalise_range = normalise_range
-        self.map_vectors = None
+        self.progressive_sample_size = progressive_sample_size
+        self.progressive_chunk_size = progressive_chunk_size
+        self.method = method
+        self.pre_components = pre_components
+        self.reuse_neighbours = reuse_neighbours
+        self.measure_memory = measure_memory
+        self.runtime_seconds = None
+        self.peak_memory_bytes = None
+        self.projection = None
+        self.complete = False
+        self.total_points = None
+        self.projection_id = None
         logging.info("DimensionReducer initialised.")
 
-    def _normalize_vectors(self, vectors):
-        """
-        Private method to normalize the vectors within the specified range.
-        """
-        keys = list(vectors.keys())
-        points = list(vectors.values())
-        x_values = [point[0] for point in points]
-        y_values = [point[1] for point in points]
-        x_min, x_max = min(x_values), max(x_values)
-        y_min, y_max = min(y_values), max(y_values)
-        normalized_vectors = {}
-        x_range, y_range = self.normalise_range
-        for key, point in zip(keys, points):
-            x_norm = (
-                (point[0] - x_min) / (x_max - x_min) * 2 - 1 if x_max > x_min else 0
+    @property
+    def ids(self):
+        """
+        Ids of the projected points, or None.
+        """
+        return None if self.projection is None else self.projection[0]
+
+    @property
+    def coordinates(self):
+        """
+        Coordinates of the projected points as an (n, 2)
+        float32 array, or None.
+        """
+        return None if self.projection is None else self.projection[1]
+
+    def __publish(self, ids, coordinates, complete=False):
+        """
+        Method to publish a projection as a single tuple so
+        readers never see ids and coordinates out of step.
+        """
+        self.projection = (
+            np.asarray(ids, dtype="int64"),
+            np.asarray(coordinates, dtype="float32"),
+        )
+        self.complete = complete
+
+    @property
+    def map_vectors(self):
+        """
+        Legacy view of the projection as a dictionary of
+        id to [x, y], built on demand for JSON responses.
+        """
+        projection = self.projection
+        if projection is None:
+            return None
+        return dict(zip(projection[0].tolist(), projection[1].tolist()))
+
+    def get_parameters(self):
+        """
+        Method to get the reducer parameters that key a
+        stored projection.
+        """
+        return {
+            "method": self.method,
+            "pre_components": self.pre_components,
+            "reuse_neighbours": self.reuse_neighbours,
+            "n_neighbours": self.n_neighbours,
+            "MN_ratio": self.MN_ratio,
+            "FP_ratio": self.FP_ratio,
+            "init": self.init,
+            "normalise_range": list(self.normalise_range),
+            "progressive_sample_size": self.progressive_sample_size,
+        }
+
+    def get_packed_coordinates(self):
+        """
+        Method to pack the projection into little-endian binary: a
+        uint32 point count, then int32 ids, then float32 x/y pairs
+        interleaved in the same order.
+        """
+        ids, coordinates = self.projection
+        return b"".join(
+            (
+                np.array([len(ids)], dtype="<u4").tobytes(),
+                ids.astype("<i4").tobytes(),
+                coordinates.astype("<f4").tobytes(),
+            )
+        )
+
+    def load_projection(self, database_connector, projection_id=None):
+        """
+        Method to load a stored projection and the parameters
+        it was made with, defaulting to the most recent. Returns
+        False if there is no matching projection.
+        """
+        projection = database_connector.load_projection(projection_id)
+        if projection is None:
+            return False
+        self.projection_id, parameters, ids, coordinates = projection
+        self.__publish(ids, coordinates, complete=True)
+        self.total_points = len(ids)
+        self.n_neighbours = parameters["n_neighbours"]
+        self.MN_ratio = parameters["MN_ratio"]
+        self.FP_ratio = parameters["FP_ratio"]
+        self.init = parameters["init"]
+        self.normalise_range = tuple(parameters["normalise_range"])
+        self.progressive_sample_size = parameters.get("progressive_sample_size")
+        self.method = parameters["method"]
+        self.pre_components = parameters.get("pre_components")
+        self.reuse_neighbours = parameters.get("reuse_neighbours", False)
+        return True
+
+    def _normalize_vectors(self, vectors, reference=None):
+        """
+        Private method to normalize an (n, 2) array of vectors within
+        the specified range. Axes with no spread are centred on zero.
+        If a reference array is given, its bounds are used so new
+        points land in the same frame as the reference.
+        """
+        vectors = np.asarray(vectors, dtype="float64")
+        reference = vectors if reference is None else np.asarray(reference)
+        if not len(reference):
+            return vectors.astype("float32")
+        minimum = reference.min(axis=0)
+        spread = reference.max(axis=0) - minimum
+        half_range = np.asarray(self.normalise_range, dtype="float64") / 2
+        scale = np.divide(
+            2 * half_range, spread, out=np.zeros_like(spread), where=spread > 0
+        )
+        offset = np.where(spread > 0, half_range, 0)
+        return ((vectors - minimum) * scale - offset).astype("float32")
+
+    def __find_projection(self, database_connector, embedding_field):
+        """
+        Method to find the stored projection to extend, which is
+        the loaded projection or one made with the same parameters.
+        """
+        if self.projection_id is not None:
+            return self.projection_id
+        parameters = self.get_parameters()
+        for projection in database_connector.list_projections():
+            if (
+                projection["embeddingField"] == embedding_field
+                and projection["parameters"] == parameters
+            ):
+                return projection["id"]
+        return None
+
+    def __project_new_rows(self, database_connector, embedding_field, job=None):
+        """
+        Method to place rows missing from a stored projection into
+        its existing layout with the saved reducer model. Returns
+        False if there is no saved model to extend.
+        """
+        projection_id = self.__find_projection(database_connector, embedding_field)
+        if projection_id is None:
+            logging.info("DimensionReducer found no projection to extend.")
+            return False
+        model_prefix = database_connector.get_projection_model_prefix(projection_id)
+        if not backend_exists(model_prefix):
+            logging.info("DimensionReducer found no saved model to extend.")
+            return False
+        _, _, projected_ids, projected_coordinates = database_connector.load_projection(
+            projection_id
+        )
+        ids, embeddings = database_connector.get_embeddings()
+        new_rows = np.flatnonzero(~np.isin(ids, projected_ids))
+        logging.info("DimensionReducer projecting %s new rows.", len(new_rows))
+        if job is not None:
+            job.set_progress("placing", 0, len(new_rows))
+
+        if len(new_rows):
+            backend = load_backend(model_prefix)
+            basis = None
+            if backend.requires_basis:
+                basis = embeddings[self.__positions(ids, backend.basis_ids)]
+            new_coordinates = self._normalize_vectors(
+                backend.transform(embeddings[new_rows], basis=basis),
+                reference=backend.reference,
             )
-            y_norm = (
-                (point[1] - y_min) / (y_max - y_min) * 2 - 1 if y_max > y_min else 0
+            all_ids = np.concatenate([projected_ids, ids[new_rows]])
+            all_coordinates = np.concatenate([projected_coordinates, new_coordinates])
+            order = np.argsort(all_ids, kind="stable")
+            projected_ids = all_ids[order]
+            projected_coordinates = all_coordinates[order]
+            if job is not None:
+                job.set_progress("placing", len(new_rows), len(new_rows))
+                job.check_cancelled()
+            database_connector.save_projection(
+                embedding_field,
+                self.get_parameters(),
+                projected_ids,
+                projected_coordinates,
             )
-            x_scaled = x_norm * (x_range / 2)
-            y_scaled = y_norm * (y_range / 2)
-            normalized_vectors[key] = [x_scaled, y_scaled]
-        return normalized_vectors
 
-    def reduce_dimensions(self, database_filename):
+        self.projection_id = projection_id
+        self.total_points = len(projected_ids)
+        self.__publish(projected_ids, projected_coordinates, complete=True)
+        return True
+
+    def __positions(self, ids, lookup_ids):
         """
-        Method to reduce the dimensions of the embeddings.
+        Method to get the row positions of lookup ids within an
+        id array, with -1 for ids that are not present.
         """
-        logging.info("DimensionReducer reducing dimensions.")
-        self.map_vectors = None
-        database_connector = DatabaseConnector(database_filename)
-        embeddings_dict = database_connector.get_embeddings()
-        embeddings = list(embeddings_dict.values())
-        config = dict(
-            n_neighbors=self.n_neighbours,
+        order = np.argsort(ids, kind="stable")
+        found = np.searchsorted(ids, lookup_ids, sorter=order)
+        found = np.minimum(found, len(ids) - 1)
+        positions = order[found]
+        return np.where(ids[positions] == lookup_ids, positions, -1)
+
+    def __stored_neighbours(self, database_connector, ids, k):
+        """
+        Method to get an (n, k) array of neighbour row positions
+        from the _nearest_neighbours column, or None if any row
+        has fewer than k stored neighbours.
+        """
+        stored = database_connector.get_nearest_neighbours()
+        if not stored or len(stored) < len(ids):
+            return None
+        neighbour_ids = []
+        for _id in ids.tolist():
+            row = stored.get(_id)
+            if row is None or len(row) < k:
+                return None
+            neighbour_ids.append(row[:k])
+        neighbours = self.__positions(ids, np.array(neighbour_ids, dtype="int64"))
+        if (neighbours < 0).any():
+            return None
+        return neighbours
+
+    def __search_neighbours(self, database_connector, ids, embeddings, k):
+        """
+        Method to widen the neighbour graph to k neighbours with
+        the FAISS index saved by the Embedder. A flat index is an
+        exact brute force search, so it is only used on datasets
+        small enough that it beats PaCMAP's own Annoy search.
+        Returns an (n, k) array of neighbour row positions, or
+        None if the index is missing, out of date, too slow or
+        returns too few results.
+        """
+        index_path, index_ids_path = database_connector.get_index_paths()
+        if not index_path.exists() or not index_ids_path.exists():
+            return None
+        index_type = database_connector.get_metadata().get("neighbour_index", "flat")
+        if index_type == "flat" and len(ids) > EXACT_NEIGHBOUR_SEARCH_MAX_POINTS:
+            logging.info(
+                "DimensionReducer skipping exact search over %s points.", len(ids)
+            )
+            return None
+        if not np.array_equal(np.load(index_ids_path), ids):
+            return None
+        logging.info("DimensionReducer searching saved %s neighbour index.", index_type)
+        index = faiss.read_index(str(index_path))
+
+        search_count = min(k + 1 + NEIGHBOUR_SEARCH_MARGIN, len(ids))
+        neighbours = np.empty((len(ids), k), dtype="int64")
+        for start in range(0, len(ids), NEIGHBOUR_SEARCH_CHUNK_SIZE):
+            chunk = np.array(
+                embeddings[start : start + NEIGHBOUR_SEARCH_CHUNK_SIZE], dtype="float32"
+            )
+            faiss.normalize_L2(chunk)
+            _, found = index.search(chunk, search_count)
+            for offset, row in enumerate(found.tolist()):
+                row = [idx for idx in row if idx != start + offset and idx != -1]
+                if len(row) < k:
+                    return None
+                neighbours[start + offset] = row[:k]
+        return neighbours
+
+    def __neighbour_graph(self, database_connector, ids, embeddings):
+        """
+        Method to get PaCMAP's nearest neighbours from the stored
+        neighbour graph, widening it with FAISS when it holds
+        fewer neighbours than PaCMAP needs. Returns None to let
+        PaCMAP search for neighbours itself.
+        """
+        k = pacmap_neighbour_count(len(ids), self.n_neighbours)
+        neighbours = self.__stored_neighbours(database_connector, ids, k)
+        if neighbours is not None:
+            logging.info("DimensionReducer using %s stored neighbours.", k)
+            return neighbours
+        logging.info("DimensionReducer widening neighbour graph to %s.", k)
+        neighbours = self.__search_neighbours(database_connector, ids, embeddings, k)
+        if neighbours is None:
+            logging.info("DimensionReducer leaving neighbour search to PaCMAP.")
+        return neighbours
+
+    def __create_backend(self):
+        """
+        Method to create the configured projection backend.
+        """
+        return create_backend(
+            self.method,
+            n_neighbours=self.n_neighbours,
             MN_ratio=self.MN_ratio,
             FP_ratio=self.FP_ratio,
+            init=self.init,
+            pre_components=self.pre_components,
+        )
+
+    def __fit_progressively(self, ids, embeddings, job=None):
+        """
+        Method to fit on a random sample and publish its layout
+        straight away, then place the remaining points in chunks
+        with transform, publishing after each chunk. Returns the
+        fitted backend.
+        """
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(
+            rng.choice(len(ids), self.progressive_sample_size, replace=False)
         )
-        projection_model = PaCMAP(
-            n_components=2,
-            **config,
+        logging.info(
+            "DimensionReducer fitting on a sample of %s points.", len(sample_rows)
         )
-        map_vectors = projection_model.fit_transform(
-            embeddings, init=self.init
-        ).tolist()
-        map_vectors = dict(zip(embeddings_dict.keys(), map_vectors))
+        backend = self.__create_backend()
+        if job is not None:
+            job.set_progress("fitting", 0, len(sample_rows))
+        projected_ids = ids[sample_rows]
+        projected_coordinates = self._normalize_vectors(
+            backend.fit_transform(embeddings[sample_rows])
+        )
+        self.__publish(projected_ids, projected_coordinates)
+
+        remaining_rows = np.setdiff1d(np.arange(len(ids)), sample_rows)
+        for start in range(0, len(remaining_rows), self.progressive_chunk_size):
+            if job is not None:
+                job.check_cancelled()
+                job.set_progress("placing", len(projected_ids), len(ids))
+            rows = remaining_rows[start : start + self.progressive_chunk_size]
+            chunk_coordinates = self._normalize_vectors(
+                backend.transform(embeddings[rows]),
+                reference=backend.reference,
+            )
+            projected_ids = np.concatenate([projected_ids, ids[rows]])
+            projected_coordinates = np.concatenate(
+                [projected_coordinates, chunk_coordinates]
+            )
+            self.__publish(projected_ids, projected_coordinates)
+            logging.info(
+                "DimensionReducer placed %s of %s points.",
+                len(projected_ids),
+                len(ids),
+            )
+
+        order = np.argsort(projected_ids, kind="stable")
+        self.__publish(projected_ids[order], projected_coordinates[order])
+        return backend
+
+    def __reduce_dimensions(self, database_connector, incremental, job=None):
+        """
+        Method to run the projection and store the result.
+        """
+        embedding_field = database_connector.get_embedding_field()
+        if incremental and self.__project_new_rows(
+            database_connector, embedding_field, job
+        ):
+            return
+
+        self.projection_id = None
+        ids, embeddings = database_connector.get_embeddings()
+        self.total_points = len(ids)
+        if self.progressive_sample_size and len(ids) > self.progressive_sample_size:
+            backend = self.__fit_progressively(ids, embeddings, job)
+        else:
+            backend = self.__create_backend()
+            neighbours = None
+            if self.reuse_neighbours and backend.uses_neighbours:
+                if job is not None:
+                    job.set_progress("neighbours", 0, len(ids))
+                neighbours = self.__neighbour_graph(database_connector, ids, embeddings)
+            if job is not None:
+                job.check_cancelled()
+                job.set_progress("fitting", 0, len(ids))
+            coordinates = backend.fit_transform(embeddings, ids, neighbours)
+            self.__publish(ids, self._normalize_vectors(coordinates))
 
-        self.map_vectors = self._normalize_vectors(map_vectors)
+        if job is not None:
+            job.check_cancelled()
+            job.set_progress("saving", len(ids), len(ids))
+
+        self.projection_id = database_connector.save_projection(
+            embedding_field,
+            self.get_parameters(),
+            self.ids,
+            self.coordinates,
+        )
+        backend.save(database_connector.get_projection_model_prefix(self.projection_id))
+
+    def reduce_dimensions(self, database_filename, incremental=False, job=None):
+        """
+        Method to reduce the dimensions of the embeddings. If
+        incremental is set, only rows missing from the stored
+        projection are projected, falling back to a full fit
+        when there is no saved model to extend. If a progressive
+        sample size is set, partial coordinates are published
+        while the projection runs. Runtime is recorded for
+        comparing backends, along with peak traced memory if
+        measure_memory is set. Tracing slows the projection and
+        is process wide, so it is only for benchmarking. If a job is
+        given, progress is reported to it and cancellation is
+        checked between stages and chunks.
+        """
+        logging.info("DimensionReducer reducing dimensions with %s.", self.method)
+        self.projection = None
+        self.complete = False
+        self.runtime_seconds = None
+        self.peak_memory_bytes = None
+        database_connector = DatabaseConnector(database_filename)
+
+        tracing = self.measure_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.measure_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            self.__reduce_dimensions(database_connector, incremental, job)
+        finally:
+            self.runtime_seconds = time.perf_counter() - start
+            if self.measure_memory:
+                self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            if tracing:
+                tracemalloc.stop()
+        logging.info(
+            "DimensionReducer %s finished in %.1f s.",
+            self.method,
+            self.runtime_seconds,
+        )
+        if self.peak_memory_bytes is not None:
+            logging.info(
+                "DimensionReducer peak traced memory was %.1f MiB.",
+                self.peak_memory_bytes / 2**20,
+            )
+        self.complete = True
 
-        return self.map_vectors
+        return self.coordinates
@@ -5,14 +5,81 @@ Module to handle embedding generation.
 import io
 import json
 import logging
-import pickle
+import math
+import multiprocessing
+import os
+import queue
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize
 
-from clients.database_connector import DatabaseConnector
+from clients.database_connector import (
+    EMPTY_EMBEDDING,
+    DatabaseConnector,
+    encode_embedding,
+)
+from clients.embedding_cache import embedding_cache_key
+from clients.inference_backends import backend_ready, load_model
+
+NEIGHBOUR_CHUNK_SIZE = 10000
+NEIGHBOUR_INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+NEIGHBOUR_SEARCH_EFFORT = {
+    "fast": (0.01, 32),
+    "balanced": (0.05, 64),
+    "accurate": (0.15, 256),
+}
+MIN_APPROXIMATE_INDEX_POINTS = 10000
+NEIGHBOUR_GRAPH_MARGIN = 5
+HNSW_LINKS = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_MAX_SUBQUANTIZERS = 64
+RECALL_SAMPLE_SIZE = 1000
+PIPELINE_POLL_INTERVAL = 0.1
+ENCODE_WINDOW_SIZE = 4096
+BATCH_TOKEN_CANDIDATES = (1024, 2048, 4096, 8192, 16384)
+TUNING_SAMPLE_SIZE = 256
+TUNING_WARMUP_SIZE = 16
+TUNING_TOLERANCE = 0.95
+CHARACTERS_PER_TOKEN = 4
+MAX_CHARACTERS_PER_TOKEN = 32
+DEFAULT_MAX_SEQUENCE_LENGTH = 512
+OVERFLOW_STRATEGIES = ("truncate", "chunk")
+CHUNK_POOLING_METHODS = ("mean", "max")
+
+tuned_batch_tokens = {}
+worker_model = None
+
+
+def has_text(document):
+    """
+    Function to check whether a document has any text to embed,
+    so missing and blank values are not all embedded as the
+    same placeholder string.
+    """
+    return document is not None and bool(str(document).strip())
+
+
+def initialise_encode_worker(model_string, inference_backend, threads):
+    """
+    Function to load the model in an encoding worker process,
+    limiting its inference threads so workers share the cores
+    rather than oversubscribing them.
+    """
+    global worker_model
+    worker_model = load_model(model_string, inference_backend, threads=threads)
+
+
+def encode_in_worker(documents):
+    """
+    Function to encode one batch of documents in an encoding
+    worker process.
+    """
+    return worker_model.encode(documents, batch_size=len(documents))
 
 
 class Embedder:
@@ -26,15 +93,39 @@ class Embedder:
         embedding_field: str,
         overflow_strategy: str = "truncate",
         embedding_instruction: str = "",
-        max_batch_size: int = 50,
+        chunk_pooling: str = "mean",
+        max_batch_size: int = 256,
         compute_near_neighbours: bool = True,
         near_neighbour_count: int = 5,
+        write_sidecar: bool = True,
+        queue_depth: int = 4,
+        transaction_size: int = 1000,
+        ingest_profile: bool = False,
+        neighbour_index: str = "flat",
+        neighbour_search_effort: str = "balanced",
+        neighbour_threads: int | None = None,
+        embedding_cache=None,
+        batch_tokens: int | None = None,
+        encode_window: int = ENCODE_WINDOW_SIZE,
+        encode_workers: int = 1,
+        encode_worker_threads: int | None = None,
+        inference_backend: str = "torch",
     ):
         logging.info("Embedder initialising.")
         self.model_string = model
+        self.inference_backend = inference_backend
         self.model = None
         try:
-            self.model = SentenceTransformer(self.model_string, local_files_only=True)
+            if backend_ready(self.model_string, self.inference_backend):
+                self.model = load_model(
+                    self.model_string, self.inference_backend, local_files_only=True
+                )
+            else:
+                logging.info(
+                    "Embedder needs to export model %s for the %s backend.",
+                    self.model_string,
+                    self.inference_backend,
+                )
         except Exception as e:
             if "couldn't find them in the cached files" in str(e):
                 logging.info(
@@ -47,88 +138,811 @@ class Embedder:
                     str(e),
                 )
                 raise e
+        if overflow_strategy not in OVERFLOW_STRATEGIES:
+            logging.error("Embedder invalid overflow strategy %s.", overflow_strategy)
+            raise ValueError(f"Embedder invalid overflow strategy {overflow_strategy}.")
+        if chunk_pooling not in CHUNK_POOLING_METHODS:
+            logging.error("Embedder invalid chunk pooling %s.", chunk_pooling)
+            raise ValueError(f"Embedder invalid chunk pooling {chunk_pooling}.")
         self.embedding_field = embedding_field
         self.overflow_strategy = overflow_strategy
-        self.embedding_instruction = embedding_instruction
+        self.embedding_instruction = embedding_instruction or ""
+        self.chunk_pooling = chunk_pooling
         self.log_buffer = io.StringIO()
         self.max_batch_size = max_batch_size
         self.compute_near_neighbours = compute_near_neighbours
         self.near_neighbour_count = near_neighbour_count
+        self.write_sidecar = write_sidecar
+        self.queue_depth = queue_depth
+        self.transaction_size = transaction_size
+        self.ingest_profile = ingest_profile
+        self.neighbour_index = neighbour_index
+        self.neighbour_search_effort = neighbour_search_effort
+        self.neighbour_threads = neighbour_threads
+        self.neighbour_recall = None
+        self.embedding_cache = embedding_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batch_tokens = batch_tokens
+        self.encode_window = encode_window
+        self.encode_workers = encode_workers or os.cpu_count() or 1
+        self.encode_worker_threads = encode_worker_threads
+        self.encode_pool = None
         logging.info("Embedder initialised.")
 
+    @property
+    def model_key(self):
+        """
+        The model and inference backend as used in embedding cache
+        keys and batch size tuning.
+        """
+        if self.inference_backend == "torch":
+            return self.model_string
+        return f"{self.model_string}@{self.inference_backend}"
+
+    @property
+    def overflow_key(self):
+        """
+        The overflow strategy and pooling as used in embedding
+        cache keys.
+        """
+        if self.overflow_strategy == "chunk":
+            return f"chunk-{self.chunk_pooling}"
+        return self.overflow_strategy
+
+    def __prepare(self, documents):
+        """
+        Method to turn documents into the texts to encode with
+        the model's tokenizer. Each text is the instruction
+        followed by as much of the document as fits in the
+        model's max_seq_length. With the truncate strategy only
+        the start of a document is kept, so the model never
+        tokenizes or encodes the rest. With the chunk strategy a
+        document is split into consecutive windows that are
+        encoded separately. Returns the texts, the position of
+        the document each text came from, and each text's token
+        count. Models without a fast tokenizer fall back to a
+        character estimate and the model's own truncation.
+        """
+        instruction = self.embedding_instruction
+        documents = [str(document) for document in documents]
+        max_length = (
+            getattr(self.model, "max_seq_length", None) or DEFAULT_MAX_SEQUENCE_LENGTH
+        )
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+            texts = [instruction + document for document in documents]
+            lengths = np.minimum(
+                [len(text) // CHARACTERS_PER_TOKEN + 2 for text in texts], max_length
+            )
+            return texts, np.arange(len(texts)), lengths
+
+        reserved = tokenizer.num_special_tokens_to_add(pair=False)
+        if instruction:
+            reserved += len(
+                tokenizer(instruction, add_special_tokens=False)["input_ids"]
+            )
+        budget = max(1, max_length - reserved)
+        truncate = self.overflow_strategy == "truncate"
+        scan_length = budget * MAX_CHARACTERS_PER_TOKEN if truncate else None
+        offset_mappings = tokenizer(
+            [document[:scan_length] for document in documents],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False,
+        )["offset_mapping"]
+
+        texts = []
+        owners = []
+        lengths = []
+        for i, (document, offsets) in enumerate(zip(documents, offset_mappings)):
+            if truncate and len(offsets) < budget and len(document) > scan_length:
+                offsets = tokenizer(
+                    document,
+                    add_special_tokens=False,
+                    return_offsets_mapping=True,
+                    verbose=False,
+                )["offset_mapping"]
+            if truncate:
+                spans = [(0, min(len(offsets), budget))]
+            else:
+                spans = [
+                    (start, min(start + budget, len(offsets)))
+                    for start in range(0, len(offsets), budget)
+                ] or [(0, 0)]
+            for start, end in spans:
+                if end == start:
+                    text = document
+                elif truncate:
+                    text = document[: offsets[end - 1][1]]
+                else:
+                    text = document[offsets[start][0] : offsets[end - 1][1]]
+                texts.append(instruction + text)
+                owners.append(i)
+                lengths.append(end - start + reserved)
+        return texts, np.array(owners), np.array(lengths)
+
+    def __pool_chunks(self, embeddings, owners, count):
+        """
+        Method to pool the embeddings of each document's chunks
+        into one embedding per document, renormalising if the
+        model normalises its output.
+        """
+        if len(owners) == count:
+            return embeddings
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        if self.chunk_pooling == "max":
+            pooled = np.maximum.reduceat(embeddings, starts)
+        else:
+            pooled = np.add.reduceat(embeddings, starts) / np.diff(
+                np.r_[starts, len(owners)]
+            ).reshape(-1, 1).astype(embeddings.dtype)
+        if any(
+            isinstance(module, Normalize)
+            for module in getattr(self.model, "_modules", {}).values()
+        ):
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.where(norms == 0, 1, norms)
+        return pooled.astype(embeddings.dtype)
+
+    def __token_batches(self, lengths):
+        """
+        Method to yield batches of document positions sorted by
+        token length, each holding as many documents as fit in
+        batch_tokens once padded to its longest member.
+        """
+        batch = []
+        for i in np.argsort(lengths, kind="stable").tolist():
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or (len(batch) + 1) * lengths[i] > self.batch_tokens
+            ):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
     def __embed(self, documents):
         """
         Method to generate embeddings for a list of
-        documents.
+        documents, encoding them in length-sorted batches
+        sized by a token budget to minimise padding. With
+        an encoding pool the batches are spread across its
+        worker processes. Chunked documents have all their
+        chunks encoded in the same flattened batches and are
+        then pooled.
         """
-        embeddings = self.model.encode(documents)
-        return embeddings
+        texts, owners, lengths = self.__prepare(documents)
+        batches = list(self.__token_batches(lengths))
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+        if self.encode_pool is not None:
+            results = self.encode_pool.map(encode_in_worker, batch_texts)
+        else:
+            results = (
+                self.model.encode(batch_text, batch_size=len(batch_text))
+                for batch_text in batch_texts
+            )
+        embeddings = None
+        for batch, encoded in zip(batches, results):
+            if embeddings is None:
+                embeddings = np.empty(
+                    (len(texts), encoded.shape[1]), dtype=encoded.dtype
+                )
+            embeddings[batch] = encoded
+        return self.__pool_chunks(embeddings, owners, len(documents))
 
-    def __compute_nearest_neighbours(self, database_connector):
-        logging.info("Embedder computing nearest neighbours.")
+    def __embed_unique(self, documents):
+        """
+        Method to generate embeddings for a window of documents,
+        encoding each distinct text once and scattering the
+        results back to every position it appears in.
+        """
+        positions = {}
+        inverse = [
+            positions.setdefault(document, len(positions)) for document in documents
+        ]
+        embeddings = self.__embed_cached(list(positions))
+        return embeddings[inverse]
 
-        database_connector.create_nearest_neighbours_column()
-        embeddings_dict = database_connector.get_embeddings()
+    def tune_batch_tokens(self, documents):
+        """
+        Method to find the token budget per batch that gives the
+        highest encoding throughput on this host by timing each
+        candidate on a sample of documents. Larger budgets are
+        tried until throughput stops improving, and the result is
+        remembered for the model and inference backend.
+        """
+        logging.info("Embedder tuning batch size on %s documents.", len(documents))
+        total_tokens = int(self.__prepare(documents)[2].sum())
+        self.batch_tokens = BATCH_TOKEN_CANDIDATES[0]
+        self.__embed(documents[:TUNING_WARMUP_SIZE])
+        best_tokens = BATCH_TOKEN_CANDIDATES[0]
+        best_rate = 0
+        for candidate in BATCH_TOKEN_CANDIDATES:
+            self.batch_tokens = candidate
+            start = time.perf_counter()
+            self.__embed(documents)
+            rate = total_tokens / max(time.perf_counter() - start, 1e-9)
+            logging.info(
+                "Embedder encoded %.0f tokens per second with %s tokens per batch.",
+                rate,
+                candidate,
+            )
+            if rate > best_rate:
+                best_tokens = candidate
+                best_rate = rate
+            elif rate < best_rate * TUNING_TOLERANCE:
+                break
+        self.batch_tokens = best_tokens
+        tuned_batch_tokens[self.model_key] = best_tokens
+        logging.info("Embedder using %s tokens per batch.", best_tokens)
+        return best_tokens
+
+    def __prepare_batch_tokens(self, database_connector, storage_field, job=None):
+        """
+        Method to set the token budget per batch when it is not
+        configured, reusing an earlier tuning for the model or
+        tuning on the first unenriched documents.
+        """
+        if self.batch_tokens:
+            return
+        if self.model_key in tuned_batch_tokens:
+            self.batch_tokens = tuned_batch_tokens[self.model_key]
+            return
+        sample = next(
+            database_connector.iterate_unenriched_documents(
+                storage_field, [self.embedding_field], TUNING_SAMPLE_SIZE
+            ),
+            [],
+        )
+        sample = [row for row in sample if has_text(row[self.embedding_field])]
+        if not sample:
+            self.batch_tokens = BATCH_TOKEN_CANDIDATES[-1]
+            return
+        if job is not None:
+            job.set_progress("tuning", 0, 1)
+        self.tune_batch_tokens([row[self.embedding_field] for row in sample])
+        if job is not None:
+            job.set_progress("tuning", 1, 1)
+
+    def __embed_cached(self, documents):
+        """
+        Method to generate embeddings for a list of documents,
+        looking the whole batch up in the embedding cache first
+        and only encoding the misses.
+        """
+        if self.embedding_cache is None:
+            return self.__embed(documents)
+        keys = [
+            embedding_cache_key(
+                self.model_key,
+                self.embedding_instruction,
+                document,
+                self.overflow_key,
+            )
+            for document in documents
+        ]
+        embeddings = self.embedding_cache.get_many(keys)
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        self.cache_hits += len(documents) - len(misses)
+        self.cache_misses += len(misses)
+        if misses:
+            encoded = self.__embed([documents[i] for i in misses])
+            self.embedding_cache.put_many([keys[i] for i in misses], encoded)
+            for i, embedding in zip(misses, encoded):
+                embeddings[i] = embedding
+        return np.stack(embeddings)
+
+    def __normalised_chunks(self, embeddings_array):
+        """
+        Method to yield L2-normalised float32 copies of
+        consecutive row chunks, leaving the source array
+        (which may be a read-only memory map) untouched.
+        """
+        for start in range(0, embeddings_array.shape[0], NEIGHBOUR_CHUNK_SIZE):
+            chunk = np.array(
+                embeddings_array[start : start + NEIGHBOUR_CHUNK_SIZE], dtype="float32"
+            )
+            faiss.normalize_L2(chunk)
+            yield chunk
+
+    def __training_sample(self, embeddings_array, size):
+        """
+        Method to return a normalised random sample of rows
+        for training an index.
+        """
+        rng = np.random.default_rng(0)
+        rows = np.sort(
+            rng.choice(
+                embeddings_array.shape[0],
+                min(size, embeddings_array.shape[0]),
+                replace=False,
+            )
+        )
+        sample = np.array(embeddings_array[rows], dtype="float32")
+        faiss.normalize_L2(sample)
+        return rows, sample
+
+    def __build_neighbour_index(self, embeddings_array):
+        """
+        Method to build and fill the configured FAISS index
+        for cosine similarity search. Approximate indexes fall
+        back to a flat index on small datasets.
+        """
+        count, dimension = embeddings_array.shape
+        index_type = self.neighbour_index
+        if index_type not in NEIGHBOUR_INDEX_TYPES:
+            logging.error("Embedder invalid neighbour index type %s.", index_type)
+            raise ValueError(f"Embedder invalid neighbour index type {index_type}.")
+        if index_type != "flat" and count < MIN_APPROXIMATE_INDEX_POINTS:
+            logging.info("Embedder using flat index for %s points.", count)
+            index_type = "flat"
+        nprobe_fraction, ef_search = NEIGHBOUR_SEARCH_EFFORT[
+            self.neighbour_search_effort
+        ]
+
+        if index_type == "flat":
+            index = faiss.IndexFlatIP(dimension)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(
+                dimension, HNSW_LINKS, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = max(HNSW_EF_CONSTRUCTION, ef_search)
+            index.hnsw.efSearch = ef_search
+        else:
+            nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+            quantizer = faiss.IndexFlatIP(dimension)
+            if index_type == "ivf":
+                index = faiss.IndexIVFFlat(
+                    quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT
+                )
+            else:
+                subquantizers = max(
+                    m
+                    for m in range(1, min(PQ_MAX_SUBQUANTIZERS, dimension) + 1)
+                    if dimension % m == 0
+                )
+                index = faiss.IndexIVFPQ(
+                    quantizer,
+                    dimension,
+                    nlist,
+                    subquantizers,
+                    8,
+                    faiss.METRIC_INNER_PRODUCT,
+                )
+            _, sample = self.__training_sample(
+                embeddings_array, max(nlist * 64, 256 * 39)
+            )
+            index.train(sample)
+            index.nprobe = max(1, math.ceil(nlist * nprobe_fraction))
+        logging.info("Embedder building %s neighbour index.", index_type)
+
+        for chunk in self.__normalised_chunks(embeddings_array):
+            index.add(chunk)
+        return index, index_type
+
+    def __stored_neighbour_count(self, count):
+        """
+        Method to get how many neighbours to store per row: the
+        configured near neighbour count, widened to cover what
+        PaCMAP needs for the dataset so the projection can reuse
+        the stored graph instead of searching again.
+        """
+        from clients.projection_backends import pacmap_neighbour_count
+
+        return max(
+            self.near_neighbour_count,
+            pacmap_neighbour_count(count) + NEIGHBOUR_GRAPH_MARGIN,
+        )
+
+    def __neighbour_rows(self, indices, offset, k):
+        """
+        Method to drop each query's own row and any missing
+        results from a block of search results.
+        """
+        return [
+            [idx for idx in row if idx != offset + i and idx != -1][:k]
+            for i, row in enumerate(indices.tolist())
+        ]
+
+    def __measure_recall(self, index, embeddings_array):
+        """
+        Method to estimate the recall of an approximate index
+        against exact search over a random sample of queries.
+        """
+        k = self.near_neighbour_count
+        rows, queries = self.__training_sample(embeddings_array, RECALL_SAMPLE_SIZE)
+        _, approximate = index.search(queries, k + 1)
+        heap = faiss.ResultHeap(len(rows), k + 1, keep_max=True)
+        offset = 0
+        for chunk in self.__normalised_chunks(embeddings_array):
+            distances, indices = faiss.knn(
+                queries, chunk, min(k + 1, len(chunk)), faiss.METRIC_INNER_PRODUCT
+            )
+            heap.add_result(distances, indices + offset)
+            offset += len(chunk)
+        heap.finalize()
+        hits = 0
+        total = 0
+        for row, approximate_row, exact_row in zip(
+            rows.tolist(), approximate.tolist(), heap.I.tolist()
+        ):
+            exact = [idx for idx in exact_row if idx != row and idx != -1][:k]
+            approximate_set = set(approximate_row) - {row}
+            hits += len(set(exact) & approximate_set)
+            total += len(exact)
+        return hits / total if total else 1.0
 
-        ids = list(embeddings_dict.keys())
-        embeddings_list = [embeddings_dict[id_val] for id_val in ids]
-        embeddings_array = np.array(embeddings_list).astype("float32")
+    def __save_index(self, database_connector, index, ids):
+        """
+        Method to serialise the neighbour index and its row ids
+        next to the database for reuse in semantic search. Files
+        are written under temporary names and then swapped in so
+        a reader never sees a partial index.
+        """
+        index_path, ids_path = database_connector.get_index_paths()
+        temporary_index_path = index_path.with_name(index_path.name + ".tmp")
+        temporary_ids_path = ids_path.with_name(ids_path.name + ".tmp.npy")
+        faiss.write_index(index, str(temporary_index_path))
+        np.save(temporary_ids_path, np.asarray(ids, dtype="int64"))
+        os.replace(temporary_ids_path, ids_path)
+        os.replace(temporary_index_path, index_path)
+        logging.info("Embedder saved neighbour index to %s.", index_path)
 
-        dimension = embeddings_array.shape[1]
-        index = faiss.IndexFlatIP(dimension)
+    def __compute_nearest_neighbours(self, database_connector, job=None):
+        logging.info("Embedder computing nearest neighbours.")
 
-        faiss.normalize_L2(embeddings_array)
-        index.add(embeddings_array)
+        database_connector.create_nearest_neighbours_column()
+        ids, embeddings_array = database_connector.get_embeddings()
+        if job is not None:
+            job.set_progress("neighbour index", 0, len(ids))
 
-        k = self.near_neighbour_count + 1
-        distances, indices = index.search(embeddings_array, k)
+        index, index_type = self.__build_neighbour_index(embeddings_array)
+        if index_type == "flat":
+            self.neighbour_recall = 1.0
+        else:
+            self.neighbour_recall = self.__measure_recall(index, embeddings_array)
+        logging.info(
+            "Embedder %s neighbour index recall: %.3f.",
+            index_type,
+            self.neighbour_recall,
+        )
+        stored_count = self.__stored_neighbour_count(len(ids))
+        database_connector.set_metadata(
+            {
+                "neighbour_index": index_type,
+                "neighbour_recall": self.neighbour_recall,
+                "near_neighbour_count": self.near_neighbour_count,
+            }
+        )
+        self.__save_index(database_connector, index, ids)
+        ids = ids.tolist()
 
+        k = stored_count + 1
         updates = []
-        for i, id_val in enumerate(ids):
-            neighbour_indices = indices[i][1:]
-            neighbour_ids = [ids[idx] for idx in neighbour_indices]
-            updates.append({"_id": id_val, "neighbours": json.dumps(neighbour_ids)})
+        offset = 0
+        for chunk in self.__normalised_chunks(embeddings_array):
+            if job is not None:
+                job.check_cancelled()
+                job.set_progress("neighbours", offset, len(ids))
+            distances, indices = index.search(chunk, k)
+            for i, neighbour_indices in enumerate(
+                self.__neighbour_rows(indices, offset, stored_count)
+            ):
+                neighbour_ids = [ids[idx] for idx in neighbour_indices]
+                updates.append((json.dumps(neighbour_ids), ids[offset + i]))
+            offset += len(chunk)
+        updates.extend(
+            (json.dumps([]), _id)
+            for _id in database_connector.get_empty_embedding_ids(
+                database_connector.get_embedding_field()
+            )
+        )
 
-        database_connector.write_nearest_neighbours(updates)
+        if job is not None:
+            job.set_progress("neighbours", offset, len(ids))
+        with database_connector.ingest_profile(self.ingest_profile):
+            database_connector.write_nearest_neighbours(
+                updates, transaction_size=self.transaction_size
+            )
         logging.info("Embedder finished computing nearest neighbours.")
 
-    def iterate_database(self, database_filename):
+    def __start_encode_pool(self):
+        """
+        Method to start a pool of encoding worker processes,
+        each loading its own copy of the model, when more than
+        one worker is configured. Worker threads default to an
+        even share of the CPU cores.
+        """
+        if self.encode_workers <= 1:
+            return
+        threads = self.encode_worker_threads or max(
+            1, (os.cpu_count() or 1) // self.encode_workers
+        )
+        logging.info(
+            "Embedder starting %s encoding workers with %s threads each.",
+            self.encode_workers,
+            threads,
+        )
+        self.encode_pool = ProcessPoolExecutor(
+            max_workers=self.encode_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialise_encode_worker,
+            initargs=(self.model_string, self.inference_backend, threads),
+        )
+
+    def __stop_encode_pool(self):
+        """
+        Method to shut down the encoding worker processes.
+        """
+        if self.encode_pool is not None:
+            self.encode_pool.shutdown(wait=True, cancel_futures=True)
+            self.encode_pool = None
+
+    def __put(self, stage_queue, item, stop_event):
+        """
+        Method to put an item onto a bounded pipeline queue,
+        blocking while it is full unless the pipeline is stopped.
+        Returns False if the pipeline stopped first.
+        """
+        while not stop_event.is_set():
+            try:
+                stage_queue.put(item, timeout=PIPELINE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, stage_queue, stop_event):
+        """
+        Method to get the next item from a pipeline queue.
+        Returns None at the end of the stream or if the
+        pipeline is stopped.
+        """
+        while not stop_event.is_set():
+            try:
+                return stage_queue.get(timeout=PIPELINE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return None
+
+    def __run_stage(self, stage, errors, stop_event, *args):
+        """
+        Method to run a pipeline stage in a thread, recording
+        any exception and stopping the other stages.
+        """
+        try:
+            stage(stop_event, *args)
+        except Exception as e:
+            logging.error(
+                "Embedder pipeline stage failed. Exception: %s, %s",
+                type(e).__name__,
+                str(e),
+            )
+            errors.append(e)
+            stop_event.set()
+
+    def __read_batches(self, stop_event, database_filename, storage_field, read_queue):
+        """
+        Method to stream batches of unenriched documents onto
+        the read queue in primary key order, resuming from the
+        persisted embedding checkpoint.
+        """
+        database_connector = DatabaseConnector(database_filename)
+        for rows in database_connector.iterate_unenriched_documents(
+            storage_field, [self.embedding_field], self.encode_window
+        ):
+            if not self.__put(read_queue, rows, stop_event):
+                return
+        self.__put(read_queue, None, stop_event)
+        logging.info("Embedder finished reading documents.")
+
+    def __write_batches(
+        self,
+        stop_event,
+        database_filename,
+        storage_field,
+        write_queue,
+        sidecar,
+        sidecar_rows,
+    ):
+        """
+        Method to write encoded batches from the write queue
+        to the embedding sidecar and then the database, storing
+        EMPTY_EMBEDDING for documents without text and advancing
+        the embedding checkpoint with each batch and committing
+        once at least transaction_size rows are pending.
+        """
+        database_connector = DatabaseConnector(database_filename)
+        pending_rows = 0
+        with database_connector.ingest_profile(self.ingest_profile):
+            try:
+                while True:
+                    item = self.__get(write_queue, stop_event)
+                    if item is None:
+                        break
+                    rows, present, embeddings = item
+                    if sidecar is not None:
+                        sidecar_ids, sidecar_embeddings = sidecar
+                        sidecar_ids[sidecar_rows : sidecar_rows + len(present)] = [
+                            rows[i]["_id"] for i in present
+                        ]
+                        sidecar_embeddings[
+                            sidecar_rows : sidecar_rows + len(present)
+                        ] = embeddings
+                        sidecar_rows += len(present)
+                    for row in rows:
+                        row[storage_field] = EMPTY_EMBEDDING
+                    for i, embedding in zip(present, embeddings):
+                        rows[i][storage_field] = encode_embedding(embedding)
+                    pending_rows += len(rows)
+                    commit = pending_rows >= self.transaction_size
+                    database_connector.write_embedded_documents(
+                        rows, storage_field, checkpoint=rows[-1]["_id"], commit=commit
+                    )
+                    if commit:
+                        pending_rows = 0
+                    logging.info("Embedder wrote enriched documents to database.")
+            finally:
+                database_connector.commit()
+        if sidecar is not None and not stop_event.is_set():
+            database_connector.complete_embedding_sidecar(*sidecar, sidecar_rows)
+
+    def iterate_database(self, database_filename, job=None):
         """
         Method to iterate over the database and
         generate embeddings for the specified field for
-        every document.
+        every document. Documents are read in windows of
+        encode_window rows, and each distinct text in a
+        window is encoded once unless it is found in the
+        embedding cache. Reads, encoding and writes run as
+        a pipeline: a reader thread and a writer thread each
+        hold their own connection and exchange batches with
+        the encoder through queues bounded by queue_depth.
+        With more than one of encode_workers, each window's
+        batches are encoded across worker processes and the
+        results gathered back to the single writer. Documents
+        without text are stored with an empty embedding and
+        left out of the neighbour index and projections. An
+        interrupted or cancelled run resumes from its last
+        checkpoint. Embeddings stored by a different model
+        are discarded and the field is embedded from the start.
+        If a job is given, progress is reported to
+        it and cancellation is checked between batches.
         """
         logging.info("Embedder iterating over database.")
         database_connector = DatabaseConnector(database_filename)
         storage_field = database_connector.create_field_to_store_embeddings(
             self.embedding_field
         )
-
-        while True:
-            rows = database_connector.get_unenriched_documents(
-                storage_field, self.max_batch_size
+        completed_rows = database_connector.get_completed_document_count(storage_field)
+        if (
+            completed_rows
+            and database_connector.get_metadata().get("embedding_format_version")
+            is None
+        ):
+            database_connector.migrate_pickled_embeddings(storage_field)
+        dimension = self.model.get_sentence_embedding_dimension()
+        if completed_rows:
+            stored_model, stored_dimension = database_connector.get_embedding_model(
+                storage_field
             )
-            if not rows:
-                logging.info("Embedder finished iterating over database.")
-                break
-            documents = [row[self.embedding_field] for row in rows]
-            ids = [row["_id"] for row in rows]
-            embeddings = self.__embed(documents)
-            for i, row in enumerate(rows):
-                row[storage_field] = pickle.dumps(embeddings[i])
-            database_connector.write_embedded_documents(rows, storage_field)
-            logging.info("Embedder wrote enriched documents to database.")
+            if (stored_model is not None and stored_model != self.model_string) or (
+                stored_dimension is not None and stored_dimension != dimension
+            ):
+                logging.info(
+                    "Embedder discarding %s embeddings from model %s.",
+                    completed_rows,
+                    stored_model,
+                )
+                database_connector.clear_embeddings(storage_field)
+                completed_rows = 0
+        database_connector.write_embedding_metadata(
+            storage_field, self.model_string, dimension
+        )
+        total_documents = database_connector.get_total_documents()
+        if job is not None:
+            job.set_progress("embedding", completed_rows, total_documents)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.__prepare_batch_tokens(database_connector, storage_field, job)
+        sidecar = None
+        if self.write_sidecar and dimension:
+            sidecar = database_connector.create_embedding_sidecar(
+                storage_field,
+                total_documents,
+                dimension,
+                resume=completed_rows > 0,
+            )
+
+        read_queue = queue.Queue(maxsize=self.queue_depth)
+        write_queue = queue.Queue(maxsize=self.queue_depth)
+        stop_event = threading.Event()
+        errors = []
+        reader = threading.Thread(
+            target=self.__run_stage,
+            args=(
+                self.__read_batches,
+                errors,
+                stop_event,
+                database_filename,
+                storage_field,
+                read_queue,
+            ),
+            daemon=True,
+        )
+        writer = threading.Thread(
+            target=self.__run_stage,
+            args=(
+                self.__write_batches,
+                errors,
+                stop_event,
+                database_filename,
+                storage_field,
+                write_queue,
+                sidecar,
+                database_connector.get_embedded_document_count(storage_field),
+            ),
+            daemon=True,
+        )
+        self.__start_encode_pool()
+        reader.start()
+        writer.start()
+
+        try:
+            encoded_rows = completed_rows
+            while True:
+                if job is not None:
+                    job.check_cancelled()
+                rows = self.__get(read_queue, stop_event)
+                if rows is None:
+                    break
+                present = [
+                    i
+                    for i, row in enumerate(rows)
+                    if has_text(row[self.embedding_field])
+                ]
+                embeddings = (
+                    self.__embed_unique(
+                        [rows[i][self.embedding_field] for i in present]
+                    )
+                    if present
+                    else np.empty((0, dimension), dtype="float32")
+                )
+                if not self.__put(write_queue, (rows, present, embeddings), stop_event):
+                    break
+                encoded_rows += len(rows)
+                if job is not None:
+                    job.set_progress("embedding", encoded_rows, total_documents)
+            self.__put(write_queue, None, stop_event)
+        except Exception:
+            stop_event.set()
+            raise
+        finally:
+            reader.join()
+            writer.join()
+            self.__stop_encode_pool()
+        if errors:
+            raise errors[0]
 
         if self.compute_near_neighbours:
-            self.__compute_nearest_neighbours(database_connector)
+            previous_threads = faiss.omp_get_max_threads()
+            if self.neighbour_threads:
+                faiss.omp_set_num_threads(self.neighbour_threads)
+            try:
+                self.__compute_nearest_neighbours(database_connector, job)
+            finally:
+                faiss.omp_set_num_threads(previous_threads)
 
         logging.info("Embedder finished iterating over database.")
 
-    def download_model(self):
+    def download_model(self, job=None):
         """
-        Method to download the model while capturing
+        Method to download the model, and export it for
+        the inference backend if needed, while capturing
         stdout logs onto self.log_buffer. This method
-        is intended to be called in a FastAPI background task.
+        is intended to be run as a scheduled job.
         """
         st_logger = logging.getLogger("sentence_transformers")
         hf_logger = logging.getLogger("huggingface_hub")
@@ -153,13 +967,18 @@ class Embedder:
         sys.stderr = self.log_buffer
 
         try:
+            if job is not None:
+                job.set_progress("download", 0, 1)
             self.log_buffer.flush()
-            self.model = SentenceTransformer(self.model_string)
+            self.model = load_model(self.model_string, self.inference_backend)
             self.log_buffer.flush()
             self.log_buffer.write("Model downloaded successfully.\n")
+            if job is not None:
+                job.set_progress("download", 1, 1)
         except Exception as e:
             self.log_buffer.write(f"Error: {str(e)}\n")
             self.log_buffer.flush()
+            raise
         finally:
             sys.stdout = original_stdout
             sys.stderr = original_stderr
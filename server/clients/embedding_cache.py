@@ -0,0 +1,194 @@
+"""
+Module to handle caching of embeddings across databases and runs.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from clients.database_connector import (
+    DATABASE_TIMEOUT_SECONDS,
+    EMBEDDING_DTYPE,
+    encode_embedding,
+)
+
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite"
+DEFAULT_EMBEDDING_CACHE_BYTES = 2 * 1024**3
+EMBEDDING_CACHE_EVICTION_RATIO = 0.9
+EMBEDDING_CACHE_LOOKUP_SIZE = 500
+
+
+def normalise_text(text):
+    """
+    Function to normalise a document before hashing so that
+    trivially different copies of the same text share an entry.
+    """
+    return unicodedata.normalize("NFC", str(text)).strip()
+
+
+def embedding_cache_key(model, instruction, text, overflow_strategy="truncate"):
+    """
+    Function to build the cache key for a document embedded
+    with a model, instruction and overflow strategy.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, overflow_strategy, instruction or "", normalise_text(text)):
+        encoded = part.encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.digest()
+
+
+class EmbeddingCache:
+    """
+    Class to store embeddings in a local SQLite file keyed by a
+    hash of the model, overflow strategy, instruction and
+    document text, evicting the least recently used entries
+    once the stored embeddings exceed max_bytes.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_EMBEDDING_CACHE_BYTES):
+        logging.info("EmbeddingCache initialising.")
+        if path is None:
+            path = Path(sys.argv[0]).parent / "databases" / EMBEDDING_CACHE_FILENAME
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            str(self.path), timeout=DATABASE_TIMEOUT_SECONDS, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+        self.size_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM embeddings"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        logging.info("EmbeddingCache initialised.")
+
+    def get_many(self, keys):
+        """
+        Method to look up a list of keys, returning an embedding
+        or None for each and marking the hits as recently used.
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_SIZE):
+                chunk = keys[start : start + EMBEDDING_CACHE_LOOKUP_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                found.update(
+                    self.conn.execute(
+                        f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                )
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self.conn.commit()
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [
+            np.frombuffer(found[key], dtype=EMBEDDING_DTYPE) if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, keys, embeddings):
+        """
+        Method to store embeddings under their keys, evicting old
+        entries if the cache has grown past max_bytes.
+        """
+        if not keys:
+            return
+        now = time.time()
+        rows = [
+            (key, encode_embedding(embedding), now)
+            for key, embedding in zip(keys, embeddings)
+        ]
+        with self.lock:
+            inserted = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                rows,
+            ).rowcount
+            self.conn.commit()
+            self.size_bytes += inserted * len(rows[0][1])
+            if self.size_bytes > self.max_bytes:
+                self.__evict()
+
+    def __evict(self):
+        """
+        Method to delete the least recently used entries until
+        the cache is back under its eviction threshold.
+        """
+        target = self.size_bytes - int(self.max_bytes * EMBEDDING_CACHE_EVICTION_RATIO)
+        cursor = self.conn.execute(
+            "SELECT key, LENGTH(embedding) FROM embeddings ORDER BY last_used"
+        )
+        evicted = []
+        freed = 0
+        for key, size in cursor:
+            if freed >= target:
+                break
+            evicted.append((key,))
+            freed += size
+        cursor.close()
+        self.conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self.conn.commit()
+        self.size_bytes -= freed
+        logging.info(
+            "EmbeddingCache evicted %s entries (%s bytes).", len(evicted), freed
+        )
+
+    def get_stats(self):
+        """
+        Method to return the size of the cache and the hits and
+        misses since the server started.
+        """
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "sizeBytes": self.size_bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else None,
+            }
+
+    def clear(self):
+        """
+        Method to delete every cached embedding.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self.size_bytes = 0
+
+    def close(self):
+        """
+        Method to close the cache's connection.
+        """
+        with self.lock:
+            self.conn.close()
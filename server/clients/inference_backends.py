@@ -0,0 +1,153 @@
+"""
+Module to handle inference backends for the embedding model.
+"""
+
+import importlib.util
+import logging
+import os
+import platform
+import shutil
+from pathlib import Path
+
+import torch
+from huggingface_hub.constants import HF_HUB_CACHE
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+EXPORTS_DIRECTORY = "shadowpuppet-exports"
+INFERENCE_BACKEND_REQUIREMENTS = {
+    "torch": (),
+    "torch-int8": (),
+    "onnx": ("optimum", "onnxruntime"),
+    "onnx-int8": ("optimum", "onnxruntime"),
+    "openvino": ("optimum", "openvino"),
+}
+EXPORTED_BACKENDS = ("onnx", "onnx-int8", "openvino")
+
+
+def module_available(name):
+    """
+    Function to check whether an optional module can be imported.
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def available_backends():
+    """
+    Function to list the inference backends whose optional
+    dependencies are installed.
+    """
+    return [
+        backend
+        for backend, modules in INFERENCE_BACKEND_REQUIREMENTS.items()
+        if all(module_available(module) for module in modules)
+    ]
+
+
+def onnx_quantization_config():
+    """
+    Function to choose the ONNX dynamic quantisation config
+    for the host CPU.
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    return "avx2"
+
+
+def export_path(model_string, backend):
+    """
+    Function to get the directory an exported model is cached
+    in, next to the Hugging Face model cache.
+    """
+    name = model_string.strip("/\\").replace("/", "--").replace("\\", "--")
+    return Path(HF_HUB_CACHE) / EXPORTS_DIRECTORY / name / backend
+
+
+def backend_ready(model_string, backend):
+    """
+    Function to check whether a backend can load a model without
+    first exporting it.
+    """
+    if backend not in EXPORTED_BACKENDS:
+        return True
+    return export_path(model_string, backend).exists()
+
+
+def export_model(model_string, backend, local_files_only):
+    """
+    Function to export a model for an ONNX or OpenVINO backend
+    and save it under export_path. The export is written to a
+    temporary directory and renamed into place so an interrupted
+    export is never loaded.
+    """
+    runtime = "openvino" if backend == "openvino" else "onnx"
+    destination = export_path(model_string, backend)
+    temporary = destination.with_name(destination.name + ".tmp")
+    shutil.rmtree(temporary, ignore_errors=True)
+    logging.info("Exporting %s for the %s backend.", model_string, backend)
+    model = SentenceTransformer(
+        model_string,
+        backend=runtime,
+        local_files_only=local_files_only,
+    )
+    model.save(str(temporary))
+    if backend == "onnx-int8":
+        export_dynamic_quantized_onnx_model(
+            model, onnx_quantization_config(), str(temporary)
+        )
+    os.replace(temporary, destination)
+    logging.info("Exported %s to %s.", model_string, destination)
+
+
+def load_model(model_string, backend="torch", local_files_only=False, threads=None):
+    """
+    Function to load a sentence transformer with an inference
+    backend. torch-int8 applies dynamic int8 quantisation to the
+    linear layers of the torch model. The ONNX and OpenVINO
+    backends export the model once and load the export from the
+    cache afterwards. If threads is given, the backend is limited
+    to that many inference threads.
+    """
+    if backend not in INFERENCE_BACKEND_REQUIREMENTS:
+        logging.error("Invalid inference backend %s.", backend)
+        raise ValueError(f"Invalid inference backend {backend}.")
+    if backend not in available_backends():
+        missing = ", ".join(INFERENCE_BACKEND_REQUIREMENTS[backend])
+        logging.error("Inference backend %s requires %s.", backend, missing)
+        raise ImportError(f"Inference backend {backend} requires {missing}.")
+
+    if backend in ("torch", "torch-int8"):
+        if threads:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(
+            model_string,
+            device="cpu" if backend == "torch-int8" else None,
+            local_files_only=local_files_only,
+        )
+        if backend == "torch-int8":
+            torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        return model
+
+    if not backend_ready(model_string, backend):
+        export_model(model_string, backend, local_files_only)
+    model_kwargs = {}
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = f"model_qint8_{onnx_quantization_config()}.onnx"
+    if threads and backend == "openvino":
+        model_kwargs["ov_config"] = {"INFERENCE_NUM_THREADS": str(threads)}
+    elif threads:
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        model_kwargs["session_options"] = session_options
+    return SentenceTransformer(
+        str(export_path(model_string, backend)),
+        backend="openvino" if backend == "openvino" else "onnx",
+        model_kwargs=model_kwargs,
+    )
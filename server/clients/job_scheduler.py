@@ -0,0 +1,263 @@
+"""
+Module to handle scheduling of long-running jobs.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 2
+SHORT_JOB_WORKERS = 2
+JOB_HISTORY_SIZE = 50
+ACTIVE_JOB_STATES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    """
+    Exception raised inside a job when it has been cancelled.
+    """
+
+
+class Job:
+    """
+    Class to hold the state and in-memory progress counters
+    of a scheduled job.
+    """
+
+    def __init__(self, kind, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.state = "queued"
+        self.stage = None
+        self.progress = {}
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.exclusive_key = None
+
+    @property
+    def active(self):
+        """
+        Whether the job is queued or running.
+        """
+        return self.state in ACTIVE_JOB_STATES
+
+    def set_progress(self, stage, completed, total=None):
+        """
+        Method to record progress through a stage, which also
+        becomes the job's current stage.
+        """
+        self.stage = stage
+        self.progress[stage] = {"completed": completed, "total": total}
+
+    def check_cancelled(self):
+        """
+        Method to raise JobCancelled if cancellation has been
+        requested, for calling at safe points in the job.
+        """
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        """
+        Method to return the job as a JSON-serialisable dictionary.
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": dict(self.progress),
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobScheduler:
+    """
+    Class to run jobs on bounded worker pools. Long jobs and
+    short jobs have separate pools so a short job never waits
+    behind long ones. Starting a job while another with the
+    same kind and key is queued or running returns the existing
+    job instead. Jobs sharing an exclusive key run one at a time,
+    in the order they were submitted.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, short_workers=SHORT_JOB_WORKERS):
+        logging.info("JobScheduler initialising.")
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self.short_executor = ThreadPoolExecutor(
+            max_workers=short_workers, thread_name_prefix="short-job"
+        )
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.held_keys = set()
+        self.waiting = {}
+        logging.info("JobScheduler initialised.")
+
+    def submit(self, kind, key, function, *args, short=False, exclusive_key=None):
+        """
+        Method to queue a function as a job. The function is
+        called with the job as the job keyword argument so it can
+        report progress and check for cancellation. Short jobs
+        run on their own pool. A job with an exclusive key is held
+        back, without taking a worker, until the job before it
+        with that key has finished.
+        """
+        with self.lock:
+            existing = self.latest(kind, key)
+            if existing is not None and existing.active:
+                logging.info("JobScheduler found %s job %s running.", kind, existing.id)
+                return existing
+            job = Job(kind, key)
+            job.exclusive_key = exclusive_key
+            self.jobs[job.id] = job
+            self.__prune()
+            executor = self.short_executor if short else self.executor
+            if exclusive_key in self.held_keys:
+                self.waiting.setdefault(exclusive_key, deque()).append(
+                    (job, executor, function, args)
+                )
+            else:
+                if exclusive_key is not None:
+                    self.held_keys.add(exclusive_key)
+                job.future = executor.submit(self.__run, job, function, args)
+        logging.info("JobScheduler queued %s job %s.", kind, job.id)
+        return job
+
+    def __release(self, exclusive_key):
+        """
+        Method to pass an exclusive key to the next waiting job
+        that has not been cancelled, or free it.
+        """
+        with self.lock:
+            waiting = self.waiting.get(exclusive_key)
+            while waiting:
+                job, executor, function, args = waiting.popleft()
+                if not job.cancel_event.is_set():
+                    job.future = executor.submit(self.__run, job, function, args)
+                    return
+            self.waiting.pop(exclusive_key, None)
+            self.held_keys.discard(exclusive_key)
+
+    def __run(self, job, function, args):
+        """
+        Method to run a job on a worker, then release its
+        exclusive key.
+        """
+        try:
+            self.__execute(job, function, args)
+        finally:
+            if job.exclusive_key is not None:
+                self.__release(job.exclusive_key)
+
+    def __execute(self, job, function, args):
+        """
+        Method to call a job's function and record its outcome.
+        """
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            job.finished = time.time()
+            return
+        job.state = "running"
+        job.started = time.time()
+        try:
+            function(*args, job=job)
+            job.state = "completed"
+        except JobCancelled:
+            logging.info("JobScheduler cancelled %s job %s.", job.kind, job.id)
+            job.state = "cancelled"
+        except Exception as e:
+            logging.error(
+                "JobScheduler %s job %s failed. Exception: %s, %s",
+                job.kind,
+                job.id,
+                type(e).__name__,
+                str(e),
+            )
+            job.error = f"{type(e).__name__}: {str(e)}"
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
+
+    def __prune(self):
+        """
+        Method to forget the oldest finished jobs beyond
+        JOB_HISTORY_SIZE.
+        """
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(self.jobs) - JOB_HISTORY_SIZE)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Method to get a job by id, or None.
+        """
+        return self.jobs.get(job_id)
+
+    def latest(self, kind, key):
+        """
+        Method to get the most recent job of a kind and key, or None.
+        """
+        for job in reversed(list(self.jobs.values())):
+            if job.kind == kind and job.key == key:
+                return job
+        return None
+
+    def active_jobs(self, kind):
+        """
+        Method to get the queued and running jobs of a kind.
+        """
+        return [job for job in self.jobs.values() if job.kind == kind and job.active]
+
+    def list_jobs(self):
+        """
+        Method to list all known jobs, newest first.
+        """
+        return [job.to_dict() for job in reversed(list(self.jobs.values()))]
+
+    def cancel(self, job_id):
+        """
+        Method to cancel a job. Queued jobs are cancelled straight
+        away and running jobs stop at their next safe point.
+        Returns False if there is no such active job.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        with self.lock:
+            job.cancel_event.set()
+            future = job.future
+            if future is None:
+                job.state = "cancelled"
+                job.finished = time.time()
+        if future is not None and future.cancel():
+            job.state = "cancelled"
+            job.finished = time.time()
+            if job.exclusive_key is not None:
+                self.__release(job.exclusive_key)
+        logging.info("JobScheduler cancelling %s job %s.", job.kind, job.id)
+        return True
+
+    def shutdown(self):
+        """
+        Method to cancel all active jobs and stop the workers
+        without waiting for running jobs to reach a safe point.
+        """
+        for job in list(self.jobs.values()):
+            if job.active:
+                self.cancel(job.id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.short_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,232 @@
+"""
+Module to handle projection backends for dimension reduction.
+"""
+
+import logging
+import os
+import pickle
+
+import numpy as np
+from pacmap import PaCMAP
+from pacmap.pacmap import load as load_pacmap
+from pacmap.pacmap import save as save_pacmap
+from sklearn.decomposition import PCA
+from sklearn.random_projection import SparseRandomProjection
+
+DEFAULT_RANDOM_PROJECTION_COMPONENTS = 128
+
+
+def pacmap_neighbour_count(count, n_neighbours=None):
+    """
+    Function to get the number of nearest neighbours PaCMAP
+    uses for a dataset, following its automatic choice when
+    n_neighbours is not set.
+    """
+    if n_neighbours is None:
+        if count <= 10000:
+            n_neighbours = 10
+        else:
+            n_neighbours = int(round(10 + 15 * (np.log10(count) - 4)))
+    return max(1, min(n_neighbours, count - 1))
+
+
+class PacmapBackend:
+    """
+    Class to project embeddings with PaCMAP, optionally after a
+    randomized PCA cut to fewer dimensions.
+    """
+
+    uses_neighbours = True
+
+    def __init__(
+        self,
+        n_neighbours=5,
+        MN_ratio=0.5,
+        FP_ratio=0.5,
+        init="pca",
+        pre_components=None,
+    ):
+        self.n_neighbours = n_neighbours
+        self.MN_ratio = MN_ratio
+        self.FP_ratio = FP_ratio
+        self.init = init
+        self.pre_components = pre_components
+        self.pre_reducer = None
+        self.model = None
+        self.reference = None
+        self.basis_ids = None
+
+    def _create_pre_reducer(self):
+        """
+        Method to create the reducer applied before PaCMAP,
+        or None to use the embeddings as they are.
+        """
+        if not self.pre_components:
+            return None
+        return PCA(
+            n_components=self.pre_components, svd_solver="randomized", random_state=0
+        )
+
+    @property
+    def requires_basis(self):
+        """
+        Whether transform needs the fitted embeddings, which is
+        the case when PaCMAP was given precomputed neighbours and
+        so never built its own neighbour tree.
+        """
+        return self.basis_ids is not None
+
+    def fit_transform(self, embeddings, ids=None, neighbours=None):
+        """
+        Method to fit the backend and return raw 2D coordinates.
+        If an (n, k) array of neighbour row positions is given, it
+        is used as PaCMAP's nearest neighbour pairs instead of an
+        Annoy search, and the ids are kept to rebuild the basis
+        for transform.
+        """
+        pair_neighbours = None
+        n_neighbours = self.n_neighbours
+        if neighbours is not None:
+            n_neighbours = neighbours.shape[1]
+            pair_neighbours = np.column_stack(
+                (
+                    np.repeat(np.arange(len(neighbours), dtype="int32"), n_neighbours),
+                    neighbours.reshape(-1).astype("int32"),
+                )
+            )
+            self.basis_ids = np.asarray(ids, dtype="int64")
+        self.pre_reducer = self._create_pre_reducer()
+        if self.pre_reducer is not None:
+            components = min(self.pre_reducer.n_components, *embeddings.shape)
+            self.pre_reducer.set_params(n_components=components)
+            logging.info("PacmapBackend reducing to %s dimensions.", components)
+            embeddings = self.pre_reducer.fit_transform(embeddings)
+        self.model = PaCMAP(
+            n_components=2,
+            n_neighbors=n_neighbours,
+            MN_ratio=self.MN_ratio,
+            FP_ratio=self.FP_ratio,
+            pair_neighbors=pair_neighbours,
+            save_tree=pair_neighbours is None,
+        )
+        self.reference = self.model.fit_transform(embeddings, init=self.init)
+        return self.reference
+
+    def transform(self, embeddings, basis=None):
+        """
+        Method to place new embeddings into the fitted layout. The
+        fitted embeddings must be passed as the basis if
+        requires_basis is set.
+        """
+        if self.pre_reducer is not None:
+            embeddings = self.pre_reducer.transform(embeddings)
+            if basis is not None:
+                basis = self.pre_reducer.transform(basis)
+        return self.model.transform(embeddings, basis=basis, init=self.init)
+
+    def save(self, prefix):
+        """
+        Method to save the backend under a path prefix. The PaCMAP
+        model is saved with its own helper, which keeps the
+        neighbour tree that cannot be pickled.
+        """
+        model, self.model = self.model, None
+        try:
+            with open(f"{prefix}.backend.pkl", "wb") as fp:
+                pickle.dump(self, fp)
+        finally:
+            self.model = model
+        save_pacmap(model, prefix)
+
+    def _load_model(self, prefix):
+        """
+        Method to reload the PaCMAP model after unpickling.
+        """
+        self.model = load_pacmap(prefix)
+
+
+class RandomProjectionPacmapBackend(PacmapBackend):
+    """
+    Class to project embeddings with a sparse random projection
+    followed by PaCMAP.
+    """
+
+    def _create_pre_reducer(self):
+        return SparseRandomProjection(
+            n_components=self.pre_components or DEFAULT_RANDOM_PROJECTION_COMPONENTS,
+            random_state=0,
+        )
+
+
+class PcaBackend:
+    """
+    Class to project embeddings onto their first two principal
+    components via randomized SVD.
+    """
+
+    uses_neighbours = False
+    requires_basis = False
+
+    def __init__(self, **kwargs):
+        self.model = None
+        self.reference = None
+
+    def fit_transform(self, embeddings, ids=None, neighbours=None):
+        """
+        Method to fit the backend and return raw 2D coordinates.
+        """
+        self.model = PCA(n_components=2, svd_solver="randomized", random_state=0)
+        self.model.fit(embeddings)
+        self.reference = self.model.transform(embeddings)
+        return self.reference
+
+    def transform(self, embeddings, basis=None):
+        """
+        Method to place new embeddings into the fitted layout.
+        """
+        return self.model.transform(embeddings)
+
+    def save(self, prefix):
+        """
+        Method to save the backend under a path prefix.
+        """
+        with open(f"{prefix}.backend.pkl", "wb") as fp:
+            pickle.dump(self, fp)
+
+    def _load_model(self, prefix):
+        pass
+
+
+PROJECTION_BACKENDS = {
+    "pacmap": PacmapBackend,
+    "pca": PcaBackend,
+    "random_projection_pacmap": RandomProjectionPacmapBackend,
+}
+
+
+def create_backend(method, **parameters):
+    """
+    Function to create a projection backend from the registry.
+    """
+    if method not in PROJECTION_BACKENDS:
+        logging.error("Invalid projection method %s.", method)
+        raise ValueError(f"Invalid projection method {method}.")
+    return PROJECTION_BACKENDS[method](**parameters)
+
+
+def backend_exists(prefix):
+    """
+    Function to check whether a saved backend exists under a
+    path prefix.
+    """
+    return os.path.exists(f"{prefix}.backend.pkl")
+
+
+def load_backend(prefix):
+    """
+    Function to load a backend saved under a path prefix.
+    """
+    with open(f"{prefix}.backend.pkl", "rb") as fp:
+        backend = pickle.load(fp)
+    backend._load_model(prefix)
+    return backend
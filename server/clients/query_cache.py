@@ -0,0 +1,221 @@
+"""
+Module to handle caching of highlight queries against a database.
+"""
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from clients.database_connector import (
+    DatabaseConnector,
+    categorical_buckets,
+    sequential_buckets,
+)
+
+DEFAULT_QUERY_CACHE_BYTES = 512 * 1024**2
+MAX_PACKED_BUCKETS = 65535
+
+
+def estimate_size(value):
+    """
+    Function to estimate the memory held by a cached value of
+    NumPy arrays, dictionaries, lists and tuples of scalars.
+    Objects shared between entries are counted for each.
+    """
+    if isinstance(value, np.ndarray):
+        size = value.nbytes
+        if value.dtype == object:
+            size += sum(map(sys.getsizeof, value))
+        return size
+    if isinstance(value, dict):
+        return (
+            sys.getsizeof(value)
+            + sum(map(sys.getsizeof, value.keys()))
+            + sum(map(sys.getsizeof, value.values()))
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(
+            (
+                estimate_size(item)
+                if isinstance(item, (np.ndarray, dict, list, tuple))
+                else sys.getsizeof(item)
+            )
+            for item in value
+        )
+    return sys.getsizeof(value)
+
+
+def pack_id_bitmap(ids):
+    """
+    Function to pack matching ids into a little-endian bitmap
+    where bit n is set if id n matched.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    mask = np.zeros(int(ids.max()) + 1 if len(ids) else 0, dtype=bool)
+    mask[ids] = True
+    return np.packbits(mask, bitorder="little").tobytes()
+
+
+def pack_bucket_numbers(buckets):
+    """
+    Function to pack lists of ids into a little-endian uint16
+    bucket count followed by one bucket number per id, where 0
+    means no bucket and n means the nth bucket. Bucket numbers
+    are uint8 for fewer than 256 buckets and uint16 otherwise.
+    """
+    if len(buckets) > MAX_PACKED_BUCKETS:
+        raise ValueError(f"Cannot pack more than {MAX_PACKED_BUCKETS} buckets.")
+    size = max((max(bucket) for bucket in buckets if bucket), default=-1) + 1
+    numbers = np.zeros(size, dtype="u1" if len(buckets) < 256 else "<u2")
+    for number, bucket in enumerate(buckets, start=1):
+        numbers[bucket] = number
+    return np.array([len(buckets)], dtype="<u2").tobytes() + numbers.tobytes()
+
+
+class QueryCache:
+    """
+    Class to cache column values and query results for a database
+    in a least recently used cache bounded by max_bytes. Entries
+    are dropped when the column they were read from is written.
+    """
+
+    def __init__(self, database_connector, max_bytes=DEFAULT_QUERY_CACHE_BYTES):
+        logging.info("QueryCache initialising.")
+        self.database_connector = database_connector
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.versions = database_connector.get_column_versions()
+        self.lock = threading.Lock()
+        logging.info("QueryCache initialised.")
+
+    def __remove(self, key):
+        """
+        Method to drop an entry and release its bytes.
+        """
+        _, size, _ = self.entries.pop(key)
+        self.size_bytes -= size
+
+    def __check_versions(self):
+        """
+        Method to drop the entries read from columns that have
+        been written since they were cached.
+        """
+        versions = self.database_connector.get_column_versions()
+        if versions == self.versions:
+            return
+        changed = {
+            column
+            for column in set(versions) | set(self.versions)
+            if versions.get(column) != self.versions.get(column)
+        }
+        for key, (_, _, field) in list(self.entries.items()):
+            if field in changed:
+                self.__remove(key)
+        self.versions = versions
+
+    def __cached(self, key, field, load):
+        """
+        Method to return a value read from a field, loading and
+        storing it on a miss and evicting the least recently used
+        entries once the cache holds more than max_bytes. Values
+        larger than max_bytes, or whose field was written while
+        they loaded, are returned without being stored.
+        """
+        with self.lock:
+            self.__check_versions()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            version = self.versions.get(field)
+        value = load()
+        size = estimate_size(value)
+        with self.lock:
+            self.__check_versions()
+            if self.versions.get(field) != version or size > self.max_bytes:
+                return value
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = (value, size, field)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self.__remove(next(iter(self.entries)))
+        return value
+
+    def get_column(self, field):
+        """
+        Method to return the ids and values of a column as NumPy
+        arrays, loaded from the database once.
+        """
+        return self.__cached(
+            ("column", field),
+            field,
+            lambda: self.database_connector.get_column_arrays(field),
+        )
+
+    def get_column_values_by_id(self, field):
+        """
+        Method to return all values of a column keyed by id.
+        """
+
+        def load():
+            ids, values = self.get_column(field)
+            return dict(zip(ids.tolist(), values.tolist()))
+
+        return self.__cached(("values", field), field, load)
+
+    def simple_query(self, field, query, operator):
+        """
+        Method to return the ids matching a simple query.
+        """
+        return self.__cached(
+            ("simple", field, query, operator),
+            field,
+            lambda: self.database_connector.simple_query(field, query, operator),
+        )
+
+    def categorical_query(self, field, buckets):
+        """
+        Method to return the ids for the most frequent values of a
+        field, bucketed in one pass over the cached column.
+        """
+
+        def load():
+            ids, values = self.get_column(field)
+            return categorical_buckets(ids, values, buckets)
+
+        return self.__cached(("categorical", field, buckets), field, load)
+
+    def sequential_query(self, field, buckets):
+        """
+        Method to return the ids for equal ranges of a sequential
+        field, bucketed in one pass over the cached column.
+        """
+
+        def load():
+            ids, values = self.get_column(field)
+            results = sequential_buckets(ids, values, buckets)
+            if results is None:
+                logging.warning(f"No data found for field '{field}'.")
+                return [[] for _ in range(buckets)]
+            return results
+
+        return self.__cached(("sequential", field, buckets), field, load)
+
+    def build_text_index(self, field, job=None):
+        """
+        Method to build a text index on its own connection,
+        for running as a scheduled job.
+        """
+        database_connector = DatabaseConnector(
+            self.database_connector.database_filename
+        )
+        try:
+            if job is not None:
+                job.set_progress("indexing", 0, 1)
+            database_connector.create_text_index(field)
+        finally:
+            database_connector.close()
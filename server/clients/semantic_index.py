@@ -0,0 +1,95 @@
+"""
+Module to handle semantic search over a saved embedding index.
+"""
+
+import logging
+import threading
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+DEFAULT_SEMANTIC_QUERY_COUNT = 100
+
+
+class SemanticIndex:
+    """
+    Class to handle semantic search against the FAISS index
+    saved by the Embedder for a database.
+    """
+
+    def __init__(self, database_connector):
+        logging.info("SemanticIndex initialising.")
+        self.database_connector = database_connector
+        self.index_path, self.ids_path = database_connector.get_index_paths()
+        self.model_string = None
+        self.index = None
+        self.ids = None
+        self.index_mtime = None
+        self.model = None
+        self.lock = threading.Lock()
+        logging.info("SemanticIndex initialised.")
+
+    def __load_index(self):
+        """
+        Method to load the saved index and its row ids, and read
+        the model recorded for them, reloading all three if the
+        Embedder has written a newer index. The files are read
+        into memory rather than memory-mapped so the Embedder can
+        swap in a new index while one is loaded.
+        """
+        if not self.index_path.exists() or not self.ids_path.exists():
+            logging.error("SemanticIndex found no saved index.")
+            raise ValueError("No semantic index. Generate embeddings first.")
+        mtime = self.index_path.stat().st_mtime_ns
+        if self.index is not None and mtime == self.index_mtime:
+            return
+        logging.info("SemanticIndex loading index from %s.", self.index_path)
+        index = faiss.read_index(str(self.index_path))
+        ids = np.load(self.ids_path)
+        if index.ntotal != len(ids):
+            logging.error("SemanticIndex index and ids are out of sync.")
+            raise ValueError("Semantic index is being rebuilt. Try again shortly.")
+        model_string = self.database_connector.get_metadata().get("embedding_model")
+        if model_string != self.model_string:
+            self.model = None
+        self.index = index
+        self.ids = ids
+        self.index_mtime = mtime
+        self.model_string = model_string
+
+    def __get_model(self, model):
+        """
+        Method to return a model for encoding queries, preferring
+        the model passed in if it is the one used for the index.
+        """
+        if model is not None and model.model_string == self.model_string:
+            if model.model:
+                return model.model
+        if self.model is None:
+            if not self.model_string:
+                logging.error("SemanticIndex found no embedding model in metadata.")
+                raise ValueError("No embedding model recorded for this database.")
+            logging.info("SemanticIndex loading model %s.", self.model_string)
+            self.model = SentenceTransformer(self.model_string, local_files_only=True)
+        return self.model
+
+    def search(self, query, count=DEFAULT_SEMANTIC_QUERY_COUNT, embedder=None):
+        """
+        Method to encode a free-text query and return the ids
+        and cosine similarity scores of the closest documents.
+        """
+        logging.info("SemanticIndex executing semantic query.")
+        with self.lock:
+            self.__load_index()
+            model = self.__get_model(embedder)
+            index = self.index
+            ids = self.ids
+        query_embedding = np.asarray(model.encode([query]), dtype="float32")
+        faiss.normalize_L2(query_embedding)
+        scores, positions = index.search(query_embedding, min(count, index.ntotal))
+        found = positions[0] >= 0
+        return {
+            "ids": ids[positions[0][found]].tolist(),
+            "scores": scores[0][found].tolist(),
+        }
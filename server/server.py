@@ -1,34 +1,52 @@
+import asyncio
+import functools
+import gzip
 import hashlib
 import io
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import pandas as pd
 import uvicorn
 from fastapi import (
-    BackgroundTasks,
     Cookie,
     Depends,
     FastAPI,
     File,
     HTTPException,
     Request,
+    Response,
     UploadFile,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 
 from clients.database_connector import DatabaseConnector, DatabaseCreator
 from clients.dimension_reducer import DimensionReducer
-from clients.embedder import Embedder
+from clients.embedder import CHUNK_POOLING_METHODS, OVERFLOW_STRATEGIES, Embedder
+from clients.embedding_cache import EmbeddingCache
+from clients.inference_backends import available_backends
+from clients.job_scheduler import JobScheduler
+from clients.projection_backends import PROJECTION_BACKENDS
+from clients.query_cache import QueryCache, pack_bucket_numbers, pack_id_bitmap
+from clients.semantic_index import DEFAULT_SEMANTIC_QUERY_COUNT, SemanticIndex
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+UPLOAD_READ_SIZE = 1024 * 1024
+UPLOAD_CHUNK_ROWS = 10000
+BINARY_GZIP_LEVEL = 1
+DATABASE_THREADS = 4
+
 
 def is_bundled():
     """
@@ -48,6 +66,117 @@ def get_resource_path(relative_path: str) -> str:
     return os.path.join(base_path, relative_path)
 
 
+def iterate_json_array(file_io):
+    """
+    Incrementally decode the objects of a top-level JSON array
+    from a text file without reading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file_io.read(UPLOAD_READ_SIZE).lstrip()
+    position = 1
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                break
+            buffer = file_io.read(UPLOAD_READ_SIZE)
+            position = 0
+            if not buffer:
+                raise ValueError("Unterminated JSON array.")
+        if buffer[position] == "]":
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            more = file_io.read(UPLOAD_READ_SIZE)
+            if not more:
+                raise
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        yield item
+
+
+def iterate_json_records(file_io, lines):
+    """
+    Yield records from a JSON array, a JSON object of columns
+    or newline-delimited JSON.
+    """
+    if lines:
+        for line in file_io:
+            if line.strip():
+                yield json.loads(line)
+        return
+    start = file_io.read(1)
+    while start.isspace():
+        start = file_io.read(1)
+    file_io.seek(0)
+    if start == "[":
+        yield from iterate_json_array(file_io)
+    else:
+        yield from pd.read_json(file_io).to_dict(orient="records")
+
+
+def read_upload_chunks(upload, filename, chunk_size=UPLOAD_CHUNK_ROWS):
+    """
+    Parse an uploaded .csv, .json or .ndjson file into lists of
+    at most chunk_size records, reading the file incrementally.
+    CSV values are kept as strings so every chunk parses a column
+    the same way, with missing values as None.
+    """
+    if filename.endswith(".csv"):
+        with pd.read_csv(upload, chunksize=chunk_size, dtype=str) as reader:
+            for df in reader:
+                yield df.astype(object).where(df.notna(), None).to_dict(
+                    orient="records"
+                )
+        return
+    file_io = io.TextIOWrapper(upload, encoding="utf-8-sig")
+    records = iterate_json_records(file_io, lines=filename.endswith(".ndjson"))
+    while chunk := list(itertools.islice(records, chunk_size)):
+        yield chunk
+
+
+async def binary_response(request, content):
+    """
+    Build a binary response, gzipping the body
+    when the client accepts it.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        content = await run_in_threadpool(gzip.compress, content, BINARY_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        content=content, media_type="application/octet-stream", headers=headers
+    )
+
+
+database_executor = ThreadPoolExecutor(
+    max_workers=DATABASE_THREADS, thread_name_prefix="database"
+)
+
+
+async def run_database(function, *args):
+    """
+    Run a blocking database call on the database thread
+    pool, each thread of which keeps its own read-only
+    connection, so the event loop stays free.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        database_executor, functools.partial(function, *args)
+    )
+
+
+def json_response(content):
+    """
+    Build a JSON response, for encoding large results
+    on the database thread pool rather than the event loop.
+    """
+    return Response(content=json.dumps(content), media_type="application/json")
+
+
 clients = {}
 
 
@@ -57,8 +186,14 @@ async def lifespan(app: FastAPI):
     clients["database_connector"] = None
     clients["embedder"] = None
     clients["dimension_reducer"] = None
+    clients["semantic_index"] = None
+    clients["query_cache"] = None
+    clients["job_scheduler"] = JobScheduler()
+    clients["embedding_cache"] = EmbeddingCache()
     logging.info("Shadowpuppet server initialised.")
     yield
+    clients["job_scheduler"].shutdown()
+    clients["embedding_cache"].close()
     clients.clear()
 
 
@@ -94,16 +229,23 @@ async def categorical_query(
 ):
     """
     Route to return buckets based on on unique values of
-    a field up to a maximum number of buckets.
+    a field up to a maximum number of buckets, or packed
+    bucket numbers when the encoding is binary.
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
     data = await request.json()
     try:
-        return clients["database_connector"].categorical_query(
+        results = await run_database(
+            clients["query_cache"].categorical_query,
             data["field"],
             data["buckets"],
         )
+        if data.get("encoding") == "binary":
+            return await binary_response(
+                request, await run_database(pack_bucket_numbers, results)
+            )
+        return await run_database(json_response, results)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error completing query: {type(e).__name__}: {str(e)}")
 
@@ -114,16 +256,23 @@ async def sequential_query(
 ):
     """
     Route to return a specified number of buckets of point
-    indexes based on a specified sequential field.
+    indexes based on a specified sequential field, or packed
+    bucket numbers when the encoding is binary.
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
     data = await request.json()
     try:
-        return clients["database_connector"].sequential_query(
+        results = await run_database(
+            clients["query_cache"].sequential_query,
             data["field"],
             data["buckets"],
         )
+        if data.get("encoding") == "binary":
+            return await binary_response(
+                request, await run_database(pack_bucket_numbers, results)
+            )
+        return await run_database(json_response, results)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error completing query: {type(e).__name__}: {str(e)}")
 
@@ -133,18 +282,93 @@ async def query(
     request: Request,
 ):
     """
-    Route to execute a simple query
-    and return matching ids.
+    Route to execute a simple query and return matching
+    ids, or a packed id bitmap when the encoding is binary.
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
     data = await request.json()
     try:
-        return clients["database_connector"].simple_query(
+        results = await run_database(
+            clients["query_cache"].simple_query,
             data["field"],
             data["query"],
             data["operator"],
         )
+        if data.get("encoding") == "binary":
+            return await binary_response(
+                request, await run_database(pack_id_bitmap, results)
+            )
+        return await run_database(json_response, results)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error completing query: {type(e).__name__}: {str(e)}")
+
+
+@app.post("/api/visualise/build-text-index")
+async def build_text_index(
+    request: Request,
+):
+    """
+    Route to start a job building a trigram text index
+    for a field so contains queries avoid a full scan.
+    """
+    if not clients["query_cache"]:
+        raise HTTPException(status_code=400, detail="No database loaded.")
+    data = await request.json()
+    if data["field"] not in await run_database(
+        clients["database_connector"].get_columns
+    ):
+        raise HTTPException(status_code=400, detail="Invalid field.")
+    job = clients["job_scheduler"].submit(
+        "text_index",
+        [clients["database_connector"].database_filename, data["field"]],
+        clients["query_cache"].build_text_index,
+        data["field"],
+        short=True,
+    )
+    return {"status": "processing", "jobId": job.id}
+
+
+@app.get("/api/visualise/text-indexes")
+async def get_text_indexes():
+    """
+    Route to list the fields with a text index
+    and the fields with one being built.
+    """
+    if not clients["query_cache"]:
+        raise HTTPException(status_code=400, detail="No database loaded.")
+    database_filename = clients["database_connector"].database_filename
+    return {
+        "indexed": await run_database(
+            clients["database_connector"].get_text_indexes
+        ),
+        "building": sorted(
+            job.key[1]
+            for job in clients["job_scheduler"].active_jobs("text_index")
+            if job.key[0] == database_filename
+        ),
+    }
+
+
+@app.post("/api/visualise/semantic-query")
+async def semantic_query(
+    request: Request,
+):
+    """
+    Route to find the points closest in meaning
+    to a free-text query and return their ids
+    and similarity scores.
+    """
+    if not clients["semantic_index"]:
+        raise HTTPException(status_code=400, detail="No database loaded.")
+    data = await request.json()
+    try:
+        return await run_in_threadpool(
+            clients["semantic_index"].search,
+            data["query"],
+            data.get("count", DEFAULT_SEMANTIC_QUERY_COUNT),
+            clients["embedder"],
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error completing query: {type(e).__name__}: {str(e)}")
 
@@ -155,7 +379,9 @@ async def get_point(request: Request):
     Route to get data associated with a point.
     """
     data = await request.json()
-    return clients["database_connector"].get_data_by_id(data["id"])
+    return await run_database(
+        clients["database_connector"].get_data_by_id, data["id"]
+    )
 
 
 @app.post("/api/visualise/get-column-values")
@@ -165,7 +391,10 @@ async def get_column_values(request: Request):
     Expects JSON payload: { "column": "column_name" }
     """
     data = await request.json()
-    return clients["database_connector"].get_column_values_by_id(data["column"])
+    values = await run_database(
+        clients["query_cache"].get_column_values_by_id, data["column"]
+    )
+    return await run_database(json_response, values)
 
 
 @app.get("/api/visualise/get-coordinates")
@@ -178,6 +407,24 @@ async def get_coordinates():
     }
 
 
+@app.get("/api/visualise/get-coordinates-binary")
+async def get_coordinates_binary(request: Request):
+    """
+    Route to get the coordinates of points as packed binary:
+    a uint32 point count, int32 ids and interleaved float32
+    x/y pairs, all little-endian. The body is gzipped when the
+    client accepts it.
+    """
+    if (
+        not clients["dimension_reducer"]
+        or clients["dimension_reducer"].coordinates is None
+    ):
+        raise HTTPException(status_code=400, detail="No projection loaded.")
+    return await binary_response(
+        request, clients["dimension_reducer"].get_packed_coordinates()
+    )
+
+
 @app.get("/api/visualise/list-databases")
 async def list_databases():
     """
@@ -197,27 +444,48 @@ async def list_databases():
 async def check_progress():
     """
     Route to check the progress of the embedding
-    generation.
+    generation, read from the in-memory counters of
+    the embedding job when there is one.
     """
-    storage_field = clients["embedder"].embedding_field + "_embedding"
+    job = clients["job_scheduler"].latest(
+        "embedding", clients["database_connector"].database_filename
+    )
+    if job is None:
+        storage_field = clients["embedder"].embedding_field + "_embedding"
+        return {
+            "completedDocuments": await run_database(
+                clients["database_connector"].get_completed_document_count,
+                storage_field,
+            ),
+            "nearNeighbourComplete": await run_database(
+                clients["database_connector"].is_nearest_neighbours_complete
+            ),
+            "neighbourRecall": clients["embedder"].neighbour_recall,
+            "cacheHits": clients["embedder"].cache_hits,
+            "cacheMisses": clients["embedder"].cache_misses,
+            "batchTokens": clients["embedder"].batch_tokens,
+        }
     return {
-        "completedDocuments": clients[
-            "database_connector"
-        ].get_completed_document_count(storage_field),
-        "nearNeighbourComplete": clients[
-            "database_connector"
-        ].is_nearest_neighbours_complete(),
+        "completedDocuments": job.progress.get("embedding", {}).get("completed", 0),
+        "nearNeighbourComplete": job.state == "completed",
+        "neighbourRecall": clients["embedder"].neighbour_recall,
+        "cacheHits": clients["embedder"].cache_hits,
+        "cacheMisses": clients["embedder"].cache_misses,
+        "batchTokens": clients["embedder"].batch_tokens,
+        "jobId": job.id,
+        "jobState": job.state,
+        "stage": job.stage,
+        "error": job.error,
     }
 
 
 @app.post("/api/embedding/queue-embeddings")
 async def queue_embeddings(
     request: Request,
-    background_tasks: BackgroundTasks,
 ):
     """
-    Route to start embedding generation in a
-    background task.
+    Route to start an embedding generation job, or
+    return the one already running for the database.
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
@@ -225,70 +493,151 @@ async def queue_embeddings(
         raise HTTPException(status_code=400, detail="No embedding model loaded.")
 
     logging.info("Queueing embedding generation.")
-    background_tasks.add_task(
+    job = clients["job_scheduler"].submit(
+        "embedding",
+        clients["database_connector"].database_filename,
         clients["embedder"].iterate_database,
         clients["database_connector"].database_filename,
+        exclusive_key=clients["database_connector"].database_filename,
     )
     logging.info("Embedding generation queued.")
     return {
         "status": "success",
+        "jobId": job.id,
     }
 
 
 @app.post("/api/dimension-reduction/run")
 async def run_dimension_reduction(
     request: Request,
-    background_tasks: BackgroundTasks,
 ):
     """
-    Route to start dimension reduction in a
-    background task.
+    Route to start a dimension reduction job, or
+    return the one already running for the database.
+    Set "incremental" to only project rows missing
+    from the stored projection.
     """
     if not clients["dimension_reducer"]:
         raise HTTPException(status_code=400, detail="No dimension reducer loaded.")
+    data = await request.json() if await request.body() else {}
     logging.info("Queueing dimension reduction.")
-    background_tasks.add_task(
+    job = clients["job_scheduler"].submit(
+        "projection",
+        clients["database_connector"].database_filename,
         clients["dimension_reducer"].reduce_dimensions,
         clients["database_connector"].database_filename,
+        data.get("incremental", False),
+        exclusive_key=clients["database_connector"].database_filename,
     )
     logging.info("Dimension reduction queued.")
     return {
         "status": "success",
+        "jobId": job.id,
     }
 
 
 @app.get("/api/dimension-reduction/check-progress")
-async def check_dimension_reduction():
+async def check_dimension_reduction(legacy: bool = False):
     """
     Route to check the progress of the dimension
-    reduction.
+    reduction. Progressive runs report "partial" once
+    a preview of the coordinates is available. The
+    projected vectors are only included as a dictionary
+    when requested with ?legacy=true.
     """
-    if clients["dimension_reducer"].map_vectors is None:
+    job = clients["job_scheduler"].latest(
+        "projection", clients["database_connector"].database_filename
+    )
+    if (
+        job is not None
+        and job.state in ("failed", "cancelled")
+        and not clients["dimension_reducer"].complete
+    ):
         return {
-            "status": "processing",
+            "status": job.state,
+            "error": job.error,
         }
-    else:
+    if clients["dimension_reducer"].coordinates is None:
         return {
-            "status": "success",
-            "mapVectors": clients["dimension_reducer"].map_vectors,
+            "status": "processing",
         }
+    response = {
+        "status": "success" if clients["dimension_reducer"].complete else "partial",
+        "pointCount": len(clients["dimension_reducer"].coordinates),
+        "totalPoints": clients["dimension_reducer"].total_points,
+        "runtimeSeconds": clients["dimension_reducer"].runtime_seconds,
+        "peakMemoryBytes": clients["dimension_reducer"].peak_memory_bytes,
+    }
+    if legacy:
+        response["mapVectors"] = clients["dimension_reducer"].map_vectors
+    return response
+
+
+@app.get("/api/dimension-reduction/list-projections")
+async def list_projections():
+    """
+    Route to list the projections stored in
+    the current database.
+    """
+    if not clients["database_connector"]:
+        raise HTTPException(status_code=400, detail="No database loaded.")
+    selectedProjection = (
+        clients["dimension_reducer"].projection_id
+        if clients["dimension_reducer"]
+        else None
+    )
+    return {
+        "projections": await run_database(
+            clients["database_connector"].list_projections
+        ),
+        "selectedProjection": selectedProjection,
+    }
+
+
+@app.post("/api/dimension-reduction/load-projection")
+async def load_projection(request: Request):
+    """
+    Route to load a stored projection so its
+    coordinates are served without recomputing.
+    """
+    if not clients["database_connector"]:
+        raise HTTPException(status_code=400, detail="No database loaded.")
+    data = await request.json()
+    dimension_reducer = DimensionReducer()
+    if not await run_database(
+        dimension_reducer.load_projection,
+        clients["database_connector"],
+        data["projectionId"],
+    ):
+        raise HTTPException(status_code=400, detail="Projection not found.")
+    clients["dimension_reducer"] = dimension_reducer
+    return {
+        "status": "success",
+    }
 
 
 @app.post("/api/dimension-reduction/configure")
 async def configure_dimension_reduction(
     request: Request,
-    background_tasks: BackgroundTasks,
 ):
     """
     Route to configure the dimension reduction model.
     """
     data = await request.json()
+    method = data.get("method", "pacmap")
+    if method not in PROJECTION_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Invalid projection method {method}.")
     clients["dimension_reducer"] = None
     clients["dimension_reducer"] = DimensionReducer(
         n_neighbours=data["nNeighbours"] if data["nNeighbours"] != 0 else None,
         MN_ratio=data["nearNeighbourRatio"],
         FP_ratio=data["farNeighbourRatio"],
         init=data["initialisationMethod"],
+        progressive_sample_size=data.get("progressiveSampleSize"),
+        method=method,
+        pre_components=data.get("preComponents"),
+        reuse_neighbours=data.get("reuseNeighbours", True),
+        measure_memory=data.get("measureMemory", False),
     )
     return {
         "status": "success",
@@ -298,21 +647,55 @@ async def configure_dimension_reduction(
 @app.post("/api/embeddings/configure")
 async def configure_embeddings(
     request: Request,
-    background_tasks: BackgroundTasks,
 ):
     """
     Route to configure the embedding model.
     """
     data = await request.json()
+    if data["overflowStrategy"] not in OVERFLOW_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid overflow strategy {data['overflowStrategy']}.",
+        )
+    inference_backend = data.get("inferenceBackend", "torch")
+    if inference_backend not in available_backends():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Inference backend {inference_backend} is not available.",
+        )
+    chunk_pooling = data.get("chunkPooling", "mean")
+    if chunk_pooling not in CHUNK_POOLING_METHODS:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid chunk pooling {chunk_pooling}."
+        )
     clients["embedder"] = None
     clients["embedder"] = Embedder(
         model=data["embeddingModel"],
         overflow_strategy=data["overflowStrategy"],
         embedding_instruction=data["embeddingInstruction"],
+        chunk_pooling=chunk_pooling,
         embedding_field=data["selectedColumn"],
+        queue_depth=data.get("queueDepth", 4),
+        transaction_size=data.get("transactionSize", 1000),
+        ingest_profile=data.get("ingestProfile", False),
+        neighbour_index=data.get("neighbourIndex", "flat"),
+        neighbour_search_effort=data.get("neighbourSearchEffort", "balanced"),
+        neighbour_threads=data.get("neighbourThreads"),
+        embedding_cache=(
+            clients["embedding_cache"] if data.get("embeddingCache", True) else None
+        ),
+        batch_tokens=data.get("batchTokens"),
+        encode_workers=data.get("encodeWorkers", 1),
+        encode_worker_threads=data.get("encodeWorkerThreads"),
+        inference_backend=inference_backend,
     )
     if not clients["embedder"].model:
-        background_tasks.add_task(clients["embedder"].download_model)
+        clients["job_scheduler"].submit(
+            "model_download",
+            clients["embedder"].model_string,
+            clients["embedder"].download_model,
+            short=True,
+        )
         return {
             "status": "pending",
             "message": "model downloading",
@@ -321,16 +704,79 @@ async def configure_embeddings(
     return {"status": "success", "message": "model loaded"}
 
 
+@app.get("/api/jobs")
+async def list_jobs():
+    """
+    Route to list scheduled jobs, newest first,
+    with their states and progress counters.
+    """
+    return {"jobs": clients["job_scheduler"].list_jobs()}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Route to get the state and progress of a job.
+    """
+    job = clients["job_scheduler"].get(job_id)
+    if job is None:
+        raise HTTPException(status_code=400, detail="Job not found.")
+    return job.to_dict()
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Route to cancel a queued or running job. Running
+    jobs stop at their next safe point.
+    """
+    if not clients["job_scheduler"].cancel(job_id):
+        raise HTTPException(status_code=400, detail="No active job with that id.")
+    return {"status": "cancelling"}
+
+
+@app.get("/api/embeddings/backends")
+async def list_inference_backends():
+    """
+    Route to list the inference backends whose
+    optional dependencies are installed.
+    """
+    return {"backends": available_backends()}
+
+
+@app.get("/api/embeddings/cache")
+async def get_embedding_cache():
+    """
+    Route to get the size and hit rate of the
+    embedding cache shared across databases.
+    """
+    return await run_database(clients["embedding_cache"].get_stats)
+
+
+@app.post("/api/embeddings/cache/clear")
+async def clear_embedding_cache():
+    """
+    Route to delete every cached embedding.
+    """
+    await run_database(clients["embedding_cache"].clear)
+    return {"status": "success"}
+
+
 @app.get("/api/embeddings/check-download")
 async def check_download():
     """
     Route to check the progress of the embedding
     model download.
     """
+    job = clients["job_scheduler"].latest(
+        "model_download", clients["embedder"].model_string
+    )
     return {
         "model": clients["embedder"].model_string,
         "modelObject": str(clients["embedder"].model),
         "logs": clients["embedder"].log_buffer.getvalue(),
+        "jobState": job.state if job else None,
+        "error": job.error if job else None,
     }
 
 
@@ -354,7 +800,7 @@ async def preview_database():
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
-    return clients["database_connector"].preview_data()
+    return await run_database(clients["database_connector"].preview_data)
 
 
 @app.get("/api/database/columns")
@@ -364,7 +810,7 @@ async def get_columns():
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
-    return clients["database_connector"].get_columns()
+    return await run_database(clients["database_connector"].get_columns)
 
 
 @app.get("/api/database/total-documents")
@@ -375,7 +821,11 @@ async def get_total_documents():
     """
     if not clients["database_connector"]:
         raise HTTPException(status_code=400, detail="No database loaded.")
-    return {"totalDocuments": clients["database_connector"].get_total_documents()}
+    return {
+        "totalDocuments": await run_database(
+            clients["database_connector"].get_total_documents
+        )
+    }
 
 
 @app.post("/api/database/select-database")
@@ -387,7 +837,17 @@ async def select_database(request: Request):
     data = await request.json()
     database_name = data["database"]
     clients["database_connector"] = None
-    clients["database_connector"] = DatabaseConnector(database_name)
+    clients["database_connector"] = await run_database(
+        functools.partial(DatabaseConnector, database_name, read_only=True)
+    )
+    clients["semantic_index"] = SemanticIndex(clients["database_connector"])
+    clients["query_cache"] = QueryCache(clients["database_connector"])
+    clients["dimension_reducer"] = None
+    dimension_reducer = DimensionReducer()
+    if await run_database(
+        dimension_reducer.load_projection, clients["database_connector"]
+    ):
+        clients["dimension_reducer"] = dimension_reducer
     return {"status": "success"}
 
 
@@ -406,24 +866,22 @@ async def upload_file(file: UploadFile = File(...)):
         raise HTTPException(
             status_code=400, detail="File must be .csv, .json, or .ndjson"
         )
-    file_bytes = await file.read()
-    file_string = file_bytes.decode("utf-8")
-    file_io = io.StringIO(file_string)
-
-    if filename.endswith(".csv"):
-        df = pd.read_csv(file_io)
-    elif filename.endswith(".json"):
-        df = pd.read_json(file_io)
-    elif filename.endswith(".ndjson"):
-        df = pd.read_json(file_io, lines=True)
-
-    data_list = df.to_dict(orient="records")
-    database_file = clients["database_creator"].create_new_database(filename, data_list)
-    clients["database_connector"] = DatabaseConnector(database_file)
+    await file.seek(0)
+    database_file = await run_in_threadpool(
+        clients["database_creator"].create_database_from_chunks,
+        filename,
+        read_upload_chunks(file.file, filename),
+    )
+    clients["database_connector"] = await run_database(
+        functools.partial(DatabaseConnector, database_file, read_only=True)
+    )
+    clients["semantic_index"] = SemanticIndex(clients["database_connector"])
+    clients["query_cache"] = QueryCache(clients["database_connector"])
 
 
 frontend_path = get_resource_path(os.path.join("frontend", "build"))
 app.mount("/", StaticFiles(directory=frontend_path, html=True), name="static")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     uvicorn.run(app, host="0.0.0.0", port=8000)